@@ -4,8 +4,6 @@ import sys
 
 import click
 import treelog as log
-from strictyaml import YAMLValidationError
-from ruamel.yaml.parser import ParserError as YAMLParserError
 
 import badger
 
@@ -17,18 +15,38 @@ class CustomClickException(click.ClickException):
 
 
 class Case(click.Path):
+    """A case, given by its directory or its case file, with the storage
+    directory given by --storage.
+    """
 
     def convert(self, value, param, ctx):
         path = Path(super().convert(value, param, ctx))
-        casefile = path / 'badger.yaml'
+        casefile = path / 'badger.yaml' if path.is_dir() else path
         if not casefile.exists():
             raise click.FileError(str(casefile), hint='does not exist')
         if not casefile.is_file():
             raise click.FileError(str(casefile), hint='is not a file')
+        storage = ctx.meta.get('badger.storage') if ctx else None
         try:
-            return badger.Case(path)
-        except (YAMLValidationError, YAMLParserError) as error:
-            raise CustomClickException(str(error))
+            return badger.Case(casefile, storage)
+        except Exception as error:
+            # Only import the YAML parser when it's been used
+            from strictyaml import YAMLValidationError
+            from ruamel.yaml.parser import ParserError as YAMLParserError
+            if isinstance(error, (YAMLValidationError, YAMLParserError, ValueError)):
+                raise CustomClickException(str(error))
+            raise
+
+
+def set_storage(ctx, param, value):
+    # Eager, so that it's known when the case is loaded
+    ctx.meta['badger.storage'] = value
+
+
+storage_option = click.option(
+    '--storage', type=click.Path(file_okay=False, path_type=Path), is_eager=True,
+    expose_value=False, callback=set_storage, help='Storage directory, instead of .badgerdata',
+)
 
 
 def print_version(ctx, param, value):
@@ -38,6 +56,18 @@ def print_version(ctx, param, value):
     ctx.exit()
 
 
+def parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        number, total = map(int, value.split('/'))
+    except ValueError:
+        raise click.BadParameter('expected I/N')
+    if not 1 <= number <= total:
+        raise click.BadParameter('expected 1 <= I <= N')
+    return number - 1, total
+
+
 def with_logger(logger):
     def decorator(func):
         @wraps(func)
@@ -80,12 +110,144 @@ def main(ctx, verbosity, rich):
 
 
 @main.command()
-@click.argument('case', default='.', type=Case(file_okay=False))
+@storage_option
+@click.argument('case', default='.', type=Case())
 def check(case):
     case.check()
 
 
 @main.command()
-@click.argument('case', default='.', type=Case(file_okay=False))
-def run(case):
-    case.run()
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1))
+@click.option('--resume', is_flag=True)
+@click.option('--shard', callback=parse_shard, metavar='I/N')
+@click.option('--backend', type=click.Choice(['local', 'batch']), default='local')
+@click.option('--submit', help='Submit command for the batch backend')
+@click.option('--chunk-size', default=1000, type=click.IntRange(min=1))
+@click.option('--poll-interval', default=10.0, type=click.FloatRange(min=0, min_open=True))
+@storage_option
+@click.argument('case', default='.', type=Case())
+def run(case, jobs, resume, shard, backend, submit, chunk_size, poll_interval):
+    from badger.backend import BatchBackend, LocalBackend
+    if backend == 'batch':
+        if submit is None:
+            raise click.UsageError('the batch backend requires --submit')
+        backend = BatchBackend(submit, chunk_size=chunk_size, interval=poll_interval)
+    else:
+        backend = LocalBackend(jobs)
+    case.run(resume=resume, shard=shard, backend=backend)
+
+
+@main.command('run-point')
+@storage_option
+@click.argument('case', type=Case())
+@click.argument('index', type=click.IntRange(min=0))
+@click.pass_context
+def run_point(ctx, case, index):
+    size = len(case.parameters())
+    if index >= size:
+        raise click.BadParameter(f'expected an index less than {size}', param_hint='INDEX')
+    if not case.run_point(index):
+        ctx.exit(1)
+
+
+@main.command()
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1))
+@click.option('--heartbeat', default=10.0, type=click.FloatRange(min=0, min_open=True))
+@click.option('--timeout', default=60.0, type=click.FloatRange(min=0, min_open=True))
+@storage_option
+@click.argument('case', default='.', type=Case())
+def worker(case, jobs, heartbeat, timeout):
+    case.work(jobs=jobs, heartbeat=heartbeat, timeout=timeout)
+
+
+@main.command()
+@click.option('--timeout', default=60.0, type=click.FloatRange(min=0, min_open=True))
+@storage_option
+@click.argument('case', default='.', type=Case())
+def status(case, timeout):
+    for name, count in case.status(timeout).items():
+        log.user(f"{name}: {count}")
+
+
+@main.command()
+@click.option('--slowest', default=5, type=click.IntRange(min=0))
+@storage_option
+@click.argument('case', default='.', type=Case())
+def profile(case, slowest):
+    summary = case.profile(slowest)
+    if not summary['phases']:
+        log.warning("Warning: no timings recorded; run the case first")
+        return
+
+    width = max(map(len, summary['phases']))
+    log.user(f"{'phase':<{width}} {'count':>6} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'total':>9}")
+    for name, stat in summary['phases'].items():
+        log.user(
+            f"{name:<{width}} {stat['count']:>6} {stat['p50']:>9.4f} {stat['p90']:>9.4f} "
+            f"{stat['p99']:>9.4f} {stat['max']:>9.4f} {stat['total']:>9.4f}"
+        )
+
+    for record in summary['slowest']:
+        phase, duration = max(record['phases'].items(), key=lambda item: item[1])
+        log.user(f"point {record['index']}: {record['total']:.4f}s, mostly {phase} ({duration:.4f}s)")
+
+    log.user(f"overhead: {summary['overhead']:.1%} of {summary['total']:.4f}s")
+
+
+@main.command()
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1))
+@click.option('--resume', is_flag=True)
+@click.option('--shard', callback=parse_shard, metavar='I/N')
+@storage_option
+@click.argument('case', default='.', type=Case())
+def plan(case, jobs, resume, shard):
+    summary = case.plan(jobs, resume, shard)
+    unit = 's' if summary['seconds'] else ' (relative cost)'
+    if not summary['seconds']:
+        log.warning("Warning: no walltimes recorded; costs are not calibrated")
+    log.user(f"points: {summary['points']}")
+    log.user(f"total: {summary['total']:.4f}{unit}")
+    log.user(f"makespan on {jobs} jobs: {summary['makespan']:.4f}{unit}, {summary['makespan-in-order']:.4f}{unit} in grid order")
+
+
+@main.command()
+@click.option('--format', '-f', 'fmt', type=click.Choice(['npz', 'csv', 'hdf5', 'parquet']))
+@storage_option
+@click.argument('case', type=Case())
+@click.argument('output', type=click.Path(dir_okay=False, writable=True, path_type=Path))
+def export(case, fmt, output):
+    from badger.export import export as export_results
+    try:
+        export_results(case, output, fmt)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint='OUTPUT')
+    except ImportError as error:
+        raise CustomClickException(f"exporting to {fmt or output.suffix[1:]} requires {error.name}")
+    log.user(f"exported results to {output}")
+
+
+@main.group()
+def scheduler():
+    pass
+
+
+@scheduler.command()
+@click.option('--jobs', '-j', default=1, type=click.IntRange(min=1))
+@click.option('--interval', default=1.0, type=click.FloatRange(min=0, min_open=True))
+@click.option('--idle', type=click.FloatRange(min=0))
+@click.argument('queue', type=click.Path(file_okay=False))
+def serve(queue, jobs, interval, idle):
+    from badger.scheduler import LocalQueue
+    LocalQueue(queue).serve(jobs=jobs, interval=interval, idle=idle)
+
+
+@scheduler.command()
+@click.argument('queue', type=click.Path(file_okay=False))
+@click.argument('listfile', type=click.Path(exists=True, dir_okay=False))
+def submit(queue, listfile):
+    from badger.scheduler import LocalQueue
+    click.echo(LocalQueue(queue).submit(listfile))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, closing
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+
+import treelog as log
+
+from badger.render import render
+from badger.storage import FAILED, PENDING, SUCCESS
+from badger.util import dispatch
+
+
+class Backend:
+    """Strategy for executing a set of parameter points of a case."""
+
+    def run(self, case, parameters):
+        """Run the given points and return the number that succeeded."""
+        raise NotImplementedError
+
+
+class LocalBackend(Backend):
+    """Run points in threads of the current process."""
+
+    def __init__(self, jobs=1):
+        self.jobs = jobs
+
+    def run(self, case, parameters):
+        nsuccess = 0
+        with ExitStack() as stack:
+            staging = case.stage(stack)
+
+            # Points are prepared and committed in the background, so that
+            # the executing threads are kept busy running commands.  The
+            # window of dispatched points determines how far ahead the
+            # preparation runs.
+            preparer = stack.enter_context(ThreadPoolExecutor(max_workers=1))
+            committer = stack.enter_context(ThreadPoolExecutor(max_workers=1))
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=self.jobs))
+
+            def execute(prepared):
+                point = prepared.result()
+                return committer.submit(case.finish, point, case.execute(point))
+
+            prepared = (
+                (preparer.submit(case.prepare, index, namespace, staging),)
+                for index, namespace in parameters.items()
+            )
+            futures = stack.enter_context(closing(dispatch(executor, execute, prepared, window=2*self.jobs)))
+            for future in log.iter.fraction('parameter', futures, length=len(parameters)):
+                nsuccess += future.result().result()
+        return nsuccess
+
+
+class BatchBackend(Backend):
+    """Submit points to a batch scheduler as array jobs.
+
+    Each point gets a job script calling 'badger run-point'.  The scripts
+    are submitted in chunks by running the *submit* command, which is
+    rendered with the path of a file listing the scripts of the chunk
+    (`listfile`) and their number (`size`).  For example, with Slurm:
+
+        sbatch --array=1-${size} --wrap 'sh $(sed -n "$SLURM_ARRAY_TASK_ID p" ${listfile})'
+
+    Completion is detected by polling the result store, and the exit
+    status files left behind by the job scripts.
+    """
+
+    def __init__(self, submit, chunk_size=1000, interval=10.0):
+        self.submit = submit
+        self.chunk_size = chunk_size
+        self.interval = interval
+
+    def _write_script(self, case, path, index):
+        command = [
+            sys.executable, '-m', 'badger', 'run-point', '--storage', str(case.storagepath.resolve()),
+            str(case.yamlpath.resolve()), str(index),
+        ]
+        exitpath = path.with_suffix('.exit')
+        with open(path, 'w') as f:
+            f.write('#!/bin/sh\n')
+            f.write(f'{shlex.join(command)}\n')
+            f.write(f'echo $? > {shlex.quote(str(exitpath))}\n')
+        path.chmod(0o755)
+
+    def _submit(self, listfile, size):
+        command = render(self.submit, {'listfile': str(listfile), 'size': size}, mode='shell')
+        log.debug(f"submitting: {command}")
+        result = subprocess.run(shlex.split(command), capture_output=True, text=True)
+        if result.returncode:
+            raise RuntimeError(f"submit command failed with exit code {result.returncode}: {result.stderr.strip()}")
+        if result.stdout.strip():
+            log.info(result.stdout.strip())
+
+    def _poll(self, case, indices, jobdir):
+        """Yield the indices of points as their jobs complete, and return
+        when all have.
+        """
+        remaining = set(indices)
+        while True:
+            status = case.status_array().ravel()
+            for index in sorted(remaining):
+                if status[index] != PENDING:
+                    remaining.discard(index)
+                    yield index
+                elif (jobdir / f'{index}.exit').is_file():
+                    # The file is written in one go, but may still be empty
+                    exitcode = (jobdir / f'{index}.exit').read_text().strip()
+                    if not exitcode:
+                        continue
+                    # The job may have committed its result since the status
+                    # was read, so check again before failing the point
+                    with case.acquire_lock():
+                        if case._store.status(index) == PENDING:
+                            log.warning(f"job for point {index} exited with status {exitcode} without a result")
+                            case._store.mark(index, FAILED)
+                    remaining.discard(index)
+                    yield index
+            if not remaining:
+                return
+            time.sleep(self.interval)
+
+    def run(self, case, parameters):
+        batchdir = case.storagepath / 'batch'
+        if batchdir.exists():
+            shutil.rmtree(batchdir)
+        jobdir = batchdir / 'jobs'
+        jobdir.mkdir(parents=True)
+
+        # Points that ran before must not look finished while polling
+        indices = list(parameters.indices)
+        case.mark_pending(indices)
+        for index in indices:
+            self._write_script(case, jobdir / f'{index}.sh', index)
+
+        for number, chunk in enumerate(parameters.chunks(self.chunk_size)):
+            listfile = batchdir / f'chunk-{number}.txt'
+            with open(listfile, 'w') as f:
+                for index in chunk.indices:
+                    f.write(f'{jobdir / f"{index}.sh"}\n')
+            self._submit(listfile, len(chunk))
+
+        done = self._poll(case, indices, jobdir)
+        for _ in log.iter.fraction('parameter', done, length=len(indices)):
+            pass
+
+        status = case.status_array().ravel()[indices]
+        return int((status == SUCCESS).sum())
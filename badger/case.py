@@ -0,0 +1,1640 @@
+import codecs
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, closing, contextmanager, suppress
+from functools import partial
+import hashlib
+import importlib
+import importlib.util
+import inspect
+import json
+import os
+from pathlib import Path
+import re
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from threading import Lock, Timer
+from time import sleep, time as osclock
+import traceback
+
+from fasteners import InterProcessLock
+import numpy as np
+import treelog as log
+
+from badger import __version__
+from badger.backend import LocalBackend
+from badger.lease import Leases
+from badger.plan import longest_first, makespan, predict
+from badger.profile import Timings, Trace, summarize
+from badger.render import identifiers, is_constant, render
+from badger.storage import ArtifactStore, ResultCache, ResultStore, StageCache, FAILED, PENDING, SUCCESS, TIMEOUT
+from badger.util import dispatch, file_identity, find_subclass, update_digest
+from badger.workspace import Staging, provision, snapshot
+
+
+STREAM_CHUNK_SIZE = 1 << 16
+DENSE_CAPTURE_MATCHES = 64
+
+# Units of ru_maxrss, which is reported in kilobytes except on macOS
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+TYPES = {'int': int, 'float': float, 'str': str}
+
+# Read without importing, to identify the schema validated case files
+SCHEMA_PATH = Path(__file__).parent / 'schema.py'
+
+# Held while loading modules from a case directory
+IMPORT_LOCK = Lock()
+
+RESOURCE_FIELDS = {
+    'maxrss': int,
+    'utime': float,
+    'stime': float,
+    'nvcsw': int,
+    'nivcsw': int,
+}
+
+
+@contextmanager
+def time():
+    start = osclock()
+    yield lambda: end - start
+    end = osclock()
+
+
+def _numpy_dtype(tp):
+    if tp in (int, float):
+        return tp
+    return object
+
+
+def _guess_eltype(collection):
+    if all(isinstance(v, str) for v in collection):
+        return str
+    if all(isinstance(v, int) for v in collection):
+        return int
+    assert all(isinstance(v, (int, float)) for v in collection)
+    return float
+
+
+def _guess_array_eltype(array):
+    if array.dtype.kind == 'f':
+        return float
+    return _guess_eltype(array.ravel().tolist())
+
+
+def load_casedata(yamlpath, cachepath):
+    """Load and validate a case file.  Validated data is cached, keyed on
+    the contents of the file and of the schema, so that unchanged case
+    files are neither validated again nor need strictyaml to be imported.
+    """
+    with open(yamlpath, 'rb') as f:
+        text = f.read()
+    with open(SCHEMA_PATH, 'rb') as f:
+        schema = f.read()
+    digest = hashlib.sha256()
+    update_digest(digest, __version__, schema, text)
+    key = digest.hexdigest()
+
+    try:
+        with open(cachepath, 'r') as f:
+            cached = json.load(f)
+        if cached['key'] == key:
+            casedata = cached['data']
+            if 'types' in casedata:
+                casedata['types'] = {name: TYPES[tp] for name, tp in casedata['types'].items()}
+            return casedata
+    except (FileNotFoundError, ValueError, KeyError):
+        pass
+
+    from badger.schema import load_and_validate
+    casedata = load_and_validate(text.decode(), yamlpath)
+
+    cached = dict(casedata)
+    if 'types' in cached:
+        cached['types'] = {name: tp.__name__ for name, tp in cached['types'].items()}
+    with NamedTemporaryFile('w', dir=cachepath.parent, delete=False) as f:
+        json.dump({'key': key, 'data': cached}, f)
+    os.replace(f.name, cachepath)
+    return casedata
+
+
+def call_yaml(func, mapping, *args, **kwargs):
+    signature = inspect.signature(func)
+    mapping = {key.replace('-', '_'): value for key, value in mapping.items()}
+    binding = signature.bind(*args, **kwargs, **mapping)
+    return func(*binding.args, **binding.kwargs)
+
+
+class Parameter:
+
+    @classmethod
+    def load(cls, name, spec):
+        if isinstance(spec, list):
+            return cls(name, spec)
+        subcls = find_subclass(cls, spec['type'], root=False, attr='__tag__')
+        del spec['type']
+        return call_yaml(subcls, spec, name)
+
+    def __init__(self, name, values):
+        self.name = name
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+
+class UniformParameter(Parameter):
+
+    __tag__ = 'uniform'
+
+    def __init__(self, name, interval, num):
+        super().__init__(name, np.linspace(*interval, num=num))
+
+
+class GradedParameter(Parameter):
+
+    __tag__ = 'graded'
+
+    def __init__(self, name, interval, num, grading):
+        lo, hi = interval
+        step = (hi - lo) * (1 - grading) / (1 - grading ** (num - 1))
+        values = [lo]
+        for _ in range(num - 1):
+            values.append(values[-1] + step)
+            step *= grading
+        super().__init__(name, np.array(values))
+
+
+class ParameterSpace:
+    """A lazy view of (a subset of) the Cartesian product of a set of
+    parameters.  Points are addressed by their flat index in the full
+    product, and contexts are only constructed on demand.
+    """
+
+    def __init__(self, parameters, indices=None):
+        self._parameters = parameters
+        self.shape = tuple(map(len, parameters.values()))
+        if indices is None:
+            indices = range(int(np.prod(self.shape, dtype=int)))
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return ParameterSpace(self._parameters, self.indices[key])
+        return self.context(self.indices[key])
+
+    def __iter__(self):
+        for index in self.indices:
+            yield self.context(index)
+
+    def context(self, index):
+        multi = np.unravel_index(index, self.shape)
+        return {name: param[i] for (name, param), i in zip(self._parameters.items(), multi)}
+
+    def items(self):
+        for index in self.indices:
+            yield int(index), self.context(index)
+
+    def subset(self, indices):
+        return ParameterSpace(self._parameters, indices)
+
+    def index_array(self):
+        """Return the flat indices of the points as an array."""
+        if isinstance(self.indices, range):
+            return np.arange(self.indices.start, self.indices.stop, self.indices.step)
+        return np.asarray(self.indices, dtype=int)
+
+    def chunks(self, size):
+        for start in range(0, len(self), size):
+            yield self[start:start+size]
+
+    def shard(self, number, total):
+        """Return the contiguous part number *number* (zero-based) of
+        *total* roughly equal parts.
+        """
+        return self[len(self) * number // total : len(self) * (number + 1) // total]
+
+
+class FileMapping:
+
+    @classmethod
+    def load(cls, spec, **kwargs):
+        if isinstance(spec, str):
+            return cls(spec, spec, **kwargs)
+        return call_yaml(cls, spec, **kwargs)
+
+    def __init__(self, source, target, template=False):
+        self.source = source
+        self.target = target
+        self.template = template
+
+    def copy(self, context, sourcepath, targetpath, digest=None, link='copy', staging=None):
+        source = sourcepath / render(self.source, context)
+        target = targetpath / render(self.target, context)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if not self.template:
+            if digest:
+                update_digest(digest, str(target.relative_to(targetpath)), file_identity(source))
+            # Links only ever point at read-only staged copies, so that
+            # commands can't modify the original
+            if staging is None:
+                provision(source, target)
+            else:
+                provision(staging.stage(source), target, link)
+            return
+        with open(source, 'r') as f:
+            text = render(f.read(), context)
+        if digest:
+            update_digest(digest, str(target.relative_to(targetpath)), text)
+        with open(target, 'w') as f:
+            f.write(text)
+
+
+    def collect(self, context, workpath, artifacts, manifest):
+        """Store an output file of a point in the artifact store, and add
+        it to the point's manifest.
+        """
+        source = workpath / render(self.source, context)
+        target = render(self.target, context)
+        if not source.is_file():
+            log.warning(f"Warning: postfile {source.relative_to(workpath)} was not produced")
+            return
+        manifest[target] = artifacts.add(source)
+
+
+class Capture:
+
+    @classmethod
+    def load(cls, spec):
+        if isinstance(spec, str):
+            return cls(spec)
+        return call_yaml(cls, spec)
+
+    def __init__(self, pattern, mode='last'):
+        self._regex = re.compile(pattern)
+        self._mode = mode
+
+    def fingerprint(self, digest):
+        update_digest(digest, self._regex.pattern, self._mode)
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def names(self):
+        return list(self._regex.groupindex)
+
+    def renamed(self, prefix):
+        """Return the pattern with all named groups prefixed, so that it
+        can be combined with others.  Numbered backreferences can't be
+        preserved this way, so such patterns raise ValueError.
+        """
+        pattern = self._regex.pattern
+        if re.search(r'\\\d|\(\?\(\d', pattern):
+            raise ValueError(pattern)
+        pattern = re.sub(r'\(\?P<(\w+)>', rf'(?P<{prefix}\1>', pattern)
+        return re.sub(r'\(\?P=(\w+)\)', rf'(?P={prefix}\1)', pattern)
+
+    def matches(self, string, pos=0):
+        matches = self._regex.finditer(string, pos)
+        if self._mode == 'first':
+            return [match for match, _ in zip(matches, range(1))]
+        elif self._mode == 'last':
+            return list(deque(matches, maxlen=1))
+        return list(matches)
+
+
+class CaptureEngine:
+    """Applies all the captures of a command in a single pass over the
+    output.  A combined expression locates the next position where any
+    pattern matches, and a probe expression then matches all of them at
+    that position at once.  Each capture still sees the same sequence of
+    non-overlapping matches as it would with finditer.
+
+    If the patterns can't be combined, each capture is applied
+    separately.
+    """
+
+    def __init__(self, captures):
+        self._captures = captures
+        self._compiled = {}
+
+    def compile(self, active):
+        if active not in self._compiled:
+            try:
+                patterns = {i: self._captures[i].renamed(f'_{i}_') for i in active}
+                locate = re.compile('|'.join(f'(?:{p})' for p in patterns.values()))
+                probe = re.compile(''.join(f'(?:(?=(?P<_{i}>{p})))?' for i, p in patterns.items()))
+                self._compiled[active] = locate, probe
+            except (ValueError, re.error):
+                self._compiled[active] = None
+        return self._compiled[active]
+
+    def scan(self):
+        return CaptureScan(self, self._captures)
+
+
+class CaptureScan:
+    """The state of a capture engine applied to a single output stream,
+    which may be fed in several chunks.  Matches are not found across
+    chunk boundaries.
+    """
+
+    def __init__(self, engine, captures):
+        self._engine = engine
+        self._captures = captures
+        self._done = set()
+        self._values = {}
+
+    def _active(self, excluded=()):
+        return tuple(
+            i for i in range(len(self._captures))
+            if i not in self._done and i not in excluded
+        )
+
+    def _found(self, index, values):
+        if self._captures[index].mode == 'first':
+            self._done.add(index)
+        self._values[index] = values
+
+    def _scan_separately(self, index, text, pos=0):
+        for match in self._captures[index].matches(text, pos):
+            self._found(index, match.groupdict())
+
+    def feed(self, text):
+        active = self._active()
+        if not active:
+            return
+
+        compiled = self._engine.compile(active)
+        if compiled is None:
+            for i in active:
+                self._scan_separately(i, text)
+            return
+
+        # Captures that match very often are cheaper to handle with their
+        # own scan, which doesn't return to Python for every match
+        separate = set()
+        counts = dict.fromkeys(active, 0)
+        following = dict.fromkeys(active, 0)
+        pos = 0
+        while True:
+            locate, probe = compiled
+            match = locate.search(text, pos)
+            if not match:
+                return
+            pos = match.start()
+            match = probe.match(text, pos)
+
+            changed = False
+            for i in active:
+                if following[i] > pos or match.group(f'_{i}') is None:
+                    continue
+                end = match.end(f'_{i}')
+                following[i] = end if end > pos else pos + 1
+                self._found(i, {name: match.group(f'_{i}_{name}') for name in self._captures[i].names})
+                counts[i] += 1
+                if i in self._done:
+                    changed = True
+                elif counts[i] > DENSE_CAPTURE_MATCHES:
+                    self._scan_separately(i, text, following[i])
+                    separate.add(i)
+                    changed = True
+
+            # Switch to a smaller expression when captures drop out
+            if changed:
+                active = self._active(separate)
+                if not active:
+                    return
+                compiled = self._engine.compile(active)
+
+            pos = max(pos + 1, min(following[i] for i in active))
+            if pos > len(text):
+                return
+
+    def finish(self, collector):
+        for i in sorted(self._values):
+            for name, value in self._values[i].items():
+                collector.collect(name, value)
+
+
+class ResourcePopen(subprocess.Popen):
+    """A Popen that keeps the resource usage of the child process, as
+    reported when it is reaped.  This includes the usage of its own
+    children that it waited for, such as the commands run by a shell.
+    """
+
+    rusage = None
+    timed_out = False
+
+    @contextmanager
+    def deadline(self, timeout):
+        """Kill the process group of the child if it's still running after
+        *timeout* seconds, unless the block has been left by then.  The
+        child must have been started in a new session.
+        """
+        if timeout is None:
+            yield
+            return
+
+        def kill():
+            self.timed_out = True
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+        timer = Timer(timeout, kill)
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+
+    def _try_wait(self, wait_flags):
+        try:
+            pid, status, rusage = os.wait4(self.pid, wait_flags)
+        except ChildProcessError:
+            return self.pid, 0
+        if pid == self.pid:
+            self.rusage = rusage
+        return pid, status
+
+
+class Reply:
+    """Outcome of a request to a persistent command, in the shape of a
+    finished process.
+    """
+
+    rusage = None
+
+    def __init__(self, returncode, timed_out=False):
+        self.returncode = returncode
+        self.timed_out = timed_out
+
+
+class ServerPool:
+    """Running instances of a persistent command, each serving one worker
+    thread at a time.  Instances are started on demand, and replaced if
+    they die.
+
+    Requests and replies are framed by a header line.  A request is the
+    length of the input in bytes, a newline and the input.  A reply is
+    the exit status and the length of the output, separated by a space,
+    a newline and the output.
+    """
+
+    def __init__(self, command, name, cwd=None):
+        self._command = command
+        self._name = name
+        self._cwd = cwd
+        self._idle = []
+        self._running = set()
+        self._lock = Lock()
+
+    def _start(self):
+        log.debug(f"starting persistent command {self._name}")
+        proc = ResourcePopen(
+            self._command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=self._cwd,
+            shell=isinstance(self._command, str), start_new_session=True,
+        )
+        with self._lock:
+            self._running.add(proc)
+        return proc
+
+    @contextmanager
+    def acquire(self):
+        """Take an idle instance, or start a new one, for the duration of
+        the block.
+        """
+        with self._lock:
+            proc = self._idle.pop() if self._idle else None
+        if proc is not None and proc.poll() is not None:
+            log.warning(f"Warning: persistent command {self._name} exited with status {proc.returncode}; restarting")
+            with self._lock:
+                self._running.discard(proc)
+            proc = None
+        if proc is None:
+            proc = self._start()
+        try:
+            yield proc
+        finally:
+            with self._lock:
+                if proc.poll() is None:
+                    self._idle.append(proc)
+                else:
+                    self._running.discard(proc)
+
+    @staticmethod
+    def request(proc, data):
+        """Send input to an instance, and return the exit status and output
+        of its reply.  Raise EOFError if the instance dies first.
+        """
+        try:
+            proc.stdin.write(b'%d\n' % len(data) + data)
+            proc.stdin.flush()
+        except BrokenPipeError:
+            raise EOFError
+        header = proc.stdout.readline()
+        try:
+            status, length = map(int, header.split())
+        except ValueError:
+            if not header:
+                raise EOFError
+            raise EOFError(f"malformed reply header: {header[:80]!r}")
+        output = proc.stdout.read(length)
+        if len(output) < length:
+            raise EOFError
+        return status, output
+
+    def close(self):
+        """Stop all instances, by closing their input."""
+        with self._lock:
+            running, self._running, self._idle = self._running, set(), []
+        for proc in running:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        for proc in running:
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.wait()
+            proc.stdout.close()
+
+
+class BaseCommand:
+    """A step of the script, run for every point.  Subclasses implement
+    fingerprint() and run().
+    """
+
+    @classmethod
+    def load(cls, spec, sourcepath=None):
+        if isinstance(spec, (str, list)):
+            return Command(spec, sourcepath=sourcepath)
+        if 'function' in spec:
+            return call_yaml(PythonCommand, spec, sourcepath=sourcepath)
+        return call_yaml(Command, spec, sourcepath=sourcepath)
+
+    def __init__(self, name, capture_walltime=False, retries=0, retry_backoff=1.0, depends=None):
+        if retries < 0:
+            raise ValueError(f"number of retries must not be negative: {retries}")
+        self.name = name
+        self.depends = depends
+        self._capture_walltime = capture_walltime
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+
+    def add_types(self, types):
+        if self._capture_walltime:
+            types[self.name] = float
+
+    def identifiers(self):
+        """Return the names that the command may refer to, or None if it
+        may refer to anything.
+        """
+        return None
+
+    def fingerprint(self, digest, context, workpath):
+        """Add everything the results of the command depend on to the
+        cache key of a point.
+        """
+        raise NotImplementedError
+
+    def run(self, collector, context, workpath, logdir, timings=None):
+        """Run the command for a point.  Return the status of the last
+        attempt and the number of retries.
+        """
+        raise NotImplementedError
+
+    def wait_retry(self, attempt):
+        """Wait before retrying, for longer after every attempt."""
+        delay = self._retry_backoff * 2 ** (attempt - 1)
+        log.warning(f"retrying {self.name} in {delay:g}s (attempt {attempt + 1} of {self._retries + 1})")
+        sleep(delay)
+
+    def close(self):
+        """Release anything kept between points."""
+        pass
+
+
+class Command(BaseCommand):
+
+    def __init__(self, command, name=None, capture=None, capture_output=False, capture_walltime=False,
+                 capture_resources=False, stream=False, timeout=None, retries=0, retry_backoff=1.0,
+                 depends=None, persistent=False, input=None, sourcepath=None):
+        if timeout is not None and timeout <= 0:
+            raise ValueError(f"timeout must be positive: {timeout}")
+        if name is None:
+            exe = shlex.split(command)[0] if isinstance(command, str) else command[0]
+            name = Path(exe).name
+        super().__init__(name, capture_walltime, retries, retry_backoff, depends)
+
+        self._command = command
+        self._capture_output = capture_output
+        self._capture_resources = capture_resources
+        self._stream = stream
+        self._timeout = timeout
+
+        self._capture = []
+        if isinstance(capture, (str, dict)):
+            self._capture.append(Capture.load(capture))
+        elif isinstance(capture, list):
+            self._capture.extend(Capture.load(c) for c in capture)
+        self._engine = CaptureEngine(self._capture)
+
+        # A persistent command is started once per worker thread, and gets
+        # the input of each point over stdin, so its command line must be
+        # the same for all points
+        self._input = input
+        self._sourcepath = sourcepath
+        self._servers = None
+        if persistent:
+            parts = [command] if isinstance(command, str) else command
+            if not all(map(is_constant, parts)):
+                raise ValueError(f"command line of persistent command {self.name} must not depend on the context")
+            if capture_resources or stream:
+                raise ValueError(f"persistent command {self.name} can't capture resources or stream its output")
+            self._servers = ServerPool(self.render({}), self.name, sourcepath)
+        elif input is not None:
+            raise ValueError(f"command {self.name} has an input, but is not persistent")
+
+    def add_types(self, types):
+        super().add_types(types)
+        if self._capture_resources:
+            for field, tp in RESOURCE_FIELDS.items():
+                types[f'{self.name}-{field}'] = tp
+
+    def identifiers(self):
+        """Return the names that the command line may refer to, or None if
+        it may refer to anything.
+        """
+        if self._servers is not None:
+            return None if self._input is None else identifiers(self._input)
+        parts = [self._command] if isinstance(self._command, str) else self._command
+        return set().union(*map(identifiers, parts))
+
+    def render_input(self, context):
+        """Return the input of a persistent command for a point: the rendered
+        input template, or the context as JSON.
+        """
+        if self._input is None:
+            return json.dumps(context, sort_keys=True)
+        return render(self._input, context)
+
+    def close(self):
+        """Stop any running instances of a persistent command."""
+        if self._servers is not None:
+            self._servers.close()
+
+    def render(self, context):
+        if isinstance(self._command, str):
+            return render(self._command, context, mode='shell')
+        return [render(arg, context) for arg in self._command]
+
+    def fingerprint(self, digest, context, workpath):
+        command = self.render(context)
+        args = shlex.split(command) if isinstance(command, str) else command
+        update_digest(
+            digest, self.name, repr(command),
+            str(self._capture_walltime), str(self._capture_resources), str(self._stream),
+        )
+
+        # Identify the executable and any other files named on the command
+        # line, such as scripts passed to an interpreter, unless they live
+        # in the work directory, in which case they're covered by the file
+        # mappings
+        cwd = workpath if self._servers is None else Path(self._sourcepath or '.')
+        exe = shutil.which(args[0]) if '/' not in args[0] else None
+        paths = [Path(exe)] if exe else [cwd / args[0]]
+        paths.extend(cwd / arg for arg in args[1:] if arg)
+        for path in paths:
+            try:
+                if not path.is_file() or workpath in path.resolve().parents:
+                    continue
+            except OSError:
+                continue
+            update_digest(digest, file_identity(path))
+
+        if self._servers is not None:
+            update_digest(digest, 'persistent', self.render_input(context))
+
+        for capture in self._capture:
+            capture.fingerprint(digest)
+
+    def run(self, collector, context, workpath, logdir, timings=None):
+        """Run the command, retrying if it fails or times out.  Return the
+        status of the last attempt and the number of retries.
+        """
+        if timings is None:
+            timings = Timings()
+        kwargs = {'cwd': workpath}
+        command = self.render(context)
+        if isinstance(command, str):
+            kwargs['shell'] = True
+        if self._timeout is not None:
+            # Put the command in its own process group, so that it can be
+            # killed along with any children
+            kwargs['start_new_session'] = True
+
+        if logdir:
+            stdout_path = logdir / f'{self.name}.stdout'
+            stderr_path = logdir / f'{self.name}.stderr'
+        else:
+            stdout_path = stderr_path = None
+
+        if self._servers is not None:
+            # Persistent commands are already running, and get the input
+            # of the point in place of a command line
+            runner = self._run_persistent
+            command = self.render_input(context).encode()
+        elif self._stream:
+            runner = self._run_streaming
+        else:
+            runner = self._run_buffered
+        for attempt in range(self._retries + 1):
+            if attempt:
+                self.wait_retry(attempt)
+
+            with time() as duration:
+                proc = runner(collector, command, kwargs, stdout_path, stderr_path, timings)
+            duration = duration()
+
+            if not proc.returncode:
+                break
+
+            if proc.timed_out:
+                status = TIMEOUT
+                log.error(f"command {self.name} timed out after {self._timeout:g}s")
+            else:
+                status = FAILED
+                log.error(f"command {self.name} returned exit status {proc.returncode}")
+
+            if not logdir:
+                continue
+            logs = [stdout_path, stderr_path]
+            if attempt < self._retries:
+                # Keep the logs of attempts that will be retried
+                logs = [
+                    path.rename(path.with_suffix(f'.{attempt + 1}{path.suffix}')) if path.exists() else path
+                    for path in logs
+                ]
+            for stream, path in zip(('stdout', 'stderr'), logs):
+                if path.exists():
+                    log.error(f"{stream} stored in {path}")
+        else:
+            return status, self._retries
+
+        if self._capture_walltime:
+            collector.collect(self.name, duration)
+        if self._capture_resources and proc.rusage:
+            for field in RESOURCE_FIELDS:
+                value = getattr(proc.rusage, f'ru_{field}')
+                collector.collect(f'{self.name}-{field}', value * MAXRSS_UNIT if field == 'maxrss' else value)
+
+        return SUCCESS, attempt
+
+    def _run_buffered(self, collector, command, kwargs, stdout_path, stderr_path, timings):
+        with timings.phase(f'{self.name}:spawn'):
+            proc = ResourcePopen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+        with timings.phase(f'{self.name}:run'), proc, proc.deadline(self._timeout):
+            stdout, stderr = proc.communicate()
+
+        if stdout_path and (proc.returncode or self._capture_output):
+            with open(stdout_path, 'wb') as f:
+                f.write(stdout)
+            with open(stderr_path, 'wb') as f:
+                f.write(stderr)
+
+        if not proc.returncode:
+            with timings.phase(f'{self.name}:capture'):
+                scan = self._engine.scan()
+                scan.feed(stdout.decode())
+                scan.finish(collector)
+        return proc
+
+    def _run_persistent(self, collector, data, kwargs, stdout_path, stderr_path, timings):
+        # Instances run in the case directory, and their stderr is not
+        # redirected, since they outlive the points
+        with self._servers.acquire() as proc:
+            with timings.phase(f'{self.name}:run'), proc.deadline(self._timeout):
+                try:
+                    returncode, stdout = self._servers.request(proc, data)
+                except EOFError as error:
+                    if not proc.timed_out:
+                        log.error(f"persistent command {self.name} died{f': {error}' if str(error) else ''}")
+                    # Make sure it's gone, so that it's replaced
+                    with suppress(ProcessLookupError):
+                        os.killpg(proc.pid, signal.SIGKILL)
+                    proc.wait()
+                    return Reply(proc.returncode or -1, proc.timed_out)
+
+        if stdout_path and (returncode or self._capture_output):
+            with open(stdout_path, 'wb') as f:
+                f.write(stdout)
+
+        if not returncode:
+            with timings.phase(f'{self.name}:capture'):
+                scan = self._engine.scan()
+                scan.feed(stdout.decode())
+                scan.finish(collector)
+        return Reply(returncode)
+
+    def _run_streaming(self, collector, command, kwargs, stdout_path, stderr_path, timings):
+        # Output is processed line by line (or in chunks, for very long
+        # lines) so that memory usage is bounded.  Stderr is never parsed,
+        # and goes straight to the log file.
+        with ExitStack() as stack:
+            if stdout_path:
+                stdout_file = stack.enter_context(open(stdout_path, 'wb'))
+                stderr_file = stack.enter_context(open(stderr_path, 'wb'))
+            else:
+                stdout_file = None
+                stderr_file = subprocess.DEVNULL
+
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            scan = self._engine.scan()
+
+            # Parsing is interleaved with reading, and is timed separately
+            capture = Timings()
+            with timings.phase(f'{self.name}:spawn'):
+                proc = ResourcePopen(command, stdout=subprocess.PIPE, stderr=stderr_file, **kwargs)
+            with timings.phase(f'{self.name}:run'), proc, proc.deadline(self._timeout):
+                for chunk in iter(partial(proc.stdout.readline, STREAM_CHUNK_SIZE), b''):
+                    if stdout_file:
+                        stdout_file.write(chunk)
+                    with capture.phase('capture'):
+                        scan.feed(decoder.decode(chunk))
+                returncode = proc.wait()
+            if not returncode:
+                with capture.phase('capture'):
+                    scan.finish(collector)
+            timings.add(f'{self.name}:run', -capture.get('capture', 0.0))
+            timings.add(f'{self.name}:capture', capture.get('capture', 0.0))
+
+        if stdout_path and not returncode and not self._capture_output:
+            stdout_path.unlink()
+            stderr_path.unlink()
+        return proc
+
+
+class PythonCommand(BaseCommand):
+    """A command that calls a Python function, named as 'module:function',
+    in the running process.  The function gets the context of the point as
+    keyword arguments, or those of them it declares, and returns a mapping
+    of results, which must have declared types.  It doesn't run in the
+    work directory.  Modules are also looked up in the case directory,
+    and loaded from there under a name specific to the case.
+    """
+
+    def __init__(self, function, name=None, capture_walltime=False, retries=0, retry_backoff=1.0,
+                 depends=None, sourcepath=None):
+        module, sep, attr = function.partition(':')
+        if not sep or not module or not attr:
+            raise ValueError(f"function must be given as 'module:function': {function}")
+        if name is None:
+            name = attr.rpartition('.')[-1]
+        super().__init__(name, capture_walltime, retries, retry_backoff, depends)
+
+        self._function = function
+        self._sourcepath = sourcepath
+        self._resolved = None
+
+    def resolve(self):
+        """Import the function, on first use."""
+        if self._resolved is None:
+            module, _, attr = self._function.partition(':')
+            try:
+                func = self._import(module)
+                for part in attr.split('.'):
+                    func = getattr(func, part)
+            except (ImportError, AttributeError) as error:
+                raise ValueError(f"can't load function {self._function}: {error}") from error
+            self._resolved = func
+        return self._resolved
+
+    def _import(self, module):
+        """Import a module, from the case directory if it's there.  Such
+        modules aren't cached under their own name, so that cases with
+        modules of the same name don't share them.  The case directory is
+        only on the module search path while the module is executed, for
+        the imports it makes.
+        """
+        top, _, rest = module.partition('.')
+        if self._sourcepath is None:
+            return importlib.import_module(module)
+        sourcepath = Path(self._sourcepath).resolve()
+        if (sourcepath / top / '__init__.py').is_file():
+            location, search = sourcepath / top / '__init__.py', [str(sourcepath / top)]
+        elif (sourcepath / f'{top}.py').is_file():
+            location, search = sourcepath / f'{top}.py', None
+        else:
+            return importlib.import_module(module)
+
+        name = f'_badger_case_{hashlib.sha256(str(sourcepath).encode()).hexdigest()[:16]}_{top}'
+        with IMPORT_LOCK:
+            if name not in sys.modules:
+                spec = importlib.util.spec_from_file_location(name, location, submodule_search_locations=search)
+                sys.modules[name] = importlib.util.module_from_spec(spec)
+                sys.path.insert(0, str(sourcepath))
+                try:
+                    spec.loader.exec_module(sys.modules[name])
+                except BaseException:
+                    del sys.modules[name]
+                    raise
+                finally:
+                    sys.path.remove(str(sourcepath))
+        return importlib.import_module(f'{name}.{rest}' if rest else name)
+
+    def _arguments(self):
+        """Return the names of the arguments the function takes, or None if
+        it takes any keyword argument.
+        """
+        params = inspect.signature(self.resolve()).parameters.values()
+        if any(param.kind == inspect.Parameter.VAR_KEYWORD for param in params):
+            return None
+        return {
+            param.name for param in params
+            if param.kind in (inspect.Parameter.POSITIONAL_OR_KEYWORD, inspect.Parameter.KEYWORD_ONLY)
+        }
+
+    def _kwargs(self, context):
+        names = self._arguments()
+        if names is None:
+            return context
+        return {name: context[name] for name in names if name in context}
+
+    def identifiers(self):
+        return self._arguments()
+
+    def fingerprint(self, digest, context, workpath):
+        update_digest(digest, self.name, self._function, str(self._capture_walltime))
+        for name, value in sorted(self._kwargs(context).items()):
+            update_digest(digest, name, repr(value))
+        try:
+            source = inspect.getsourcefile(self.resolve())
+        except TypeError:
+            # Built-in functions have no source
+            source = None
+        if source:
+            update_digest(digest, file_identity(Path(source)))
+
+    def run(self, collector, context, workpath, logdir, timings=None):
+        """Call the function, retrying if it raises.  Return the status of
+        the last attempt and the number of retries.
+        """
+        if timings is None:
+            timings = Timings()
+        func = self.resolve()
+        kwargs = self._kwargs(context)
+
+        for attempt in range(self._retries + 1):
+            if attempt:
+                self.wait_retry(attempt)
+
+            try:
+                with timings.phase(f'{self.name}:run'), time() as duration:
+                    results = func(**kwargs)
+                break
+            except Exception as error:
+                log.error(f"function {self.name} raised {type(error).__name__}: {error}")
+                if logdir:
+                    stderr_path = logdir / f'{self.name}.stderr'
+                    if attempt < self._retries:
+                        stderr_path = stderr_path.with_suffix(f'.{attempt + 1}.stderr')
+                    with open(stderr_path, 'w') as f:
+                        traceback.print_exc(file=f)
+                    log.error(f"traceback stored in {stderr_path}")
+        else:
+            return FAILED, self._retries
+
+        with timings.phase(f'{self.name}:capture'):
+            for key, value in (results or {}).items():
+                try:
+                    collector.collect(key, value)
+                except KeyError:
+                    log.error(f"function {self.name} returned {key}, which has no declared type")
+                    return FAILED, attempt
+        if self._capture_walltime:
+            collector.collect(self.name, duration())
+
+        return SUCCESS, attempt
+
+
+class Point:
+    """A parameter point in the process of being run."""
+
+    def __init__(self, index, namespace, collector, workdir, timings):
+        self.index = index
+        self.namespace = namespace
+        self.collector = collector
+        self.workdir = workdir
+        self.timings = timings
+        self.logdir = None
+        self.key = None
+        self.inputs = None
+        self.cached = False
+        self.status = SUCCESS
+        self.retries = 0
+
+    @property
+    def workpath(self):
+        return Path(self.workdir.name)
+
+    def cleanup(self):
+        self.workdir.cleanup()
+
+
+class ResultCollector(dict):
+
+    def __init__(self, types):
+        super().__init__()
+        self._types = types
+
+    def collect(self, name, value):
+        self[name] = self._types[name](value)
+
+
+class Case:
+
+    def __init__(self, yamlpath, storagepath=None):
+        if yamlpath.is_dir():
+            yamlpath = yamlpath / 'badger.yaml'
+        self.yamlpath = yamlpath
+        self.sourcepath = yamlpath.parent
+
+        if storagepath is None:
+            storagepath = self.sourcepath / '.badgerdata'
+        storagepath.mkdir(parents=True, exist_ok=True)
+        self.storagepath = storagepath
+        self._lock = Lock()
+
+        casedata = load_casedata(yamlpath, storagepath / 'casedata.json')
+
+        # Read parameters
+        self._parameters = {}
+        for name, paramspec in casedata.get('parameters', {}).items():
+            param = Parameter.load(name, paramspec)
+            self._parameters[param.name] = param
+
+        # Read evaluables
+        self._evaluables = dict(casedata.get('evaluate', {}))
+
+        # Read file mappings
+        self._pre_files = [FileMapping.load(spec, template=True) for spec in casedata.get('templates', [])]
+        self._pre_files.extend(FileMapping.load(spec) for spec in casedata.get('prefiles', []))
+        self._post_files = [FileMapping.load(spec) for spec in casedata.get('postfiles', [])]
+
+        # Read commands, and resolve what memoized commands depend on.  A
+        # command may read what earlier commands left in the work
+        # directory, so automatic dependencies include theirs, and all
+        # variables after a command that isn't memoized.
+        self._commands = [BaseCommand.load(spec, self.sourcepath) for spec in casedata.get('script', [])]
+        variables = set(self._parameters) | set(self._evaluables)
+        upstream = set()
+        for command in self._commands:
+            if command.depends == 'auto':
+                names = command.identifiers()
+                if names is None:
+                    names = variables
+                command.depends = (names | upstream | self._input_identifiers()) & variables
+            elif command.depends is not None:
+                unknown = set(command.depends) - variables
+                if unknown:
+                    raise ValueError(f"command {command.name} depends on unknown variables: {', '.join(sorted(unknown))}")
+                command.depends = set(command.depends)
+            upstream = upstream | (variables if command.depends is None else command.depends)
+
+        # Read types
+        self._types = {key: value for key, value in casedata.get('types', {}).items()}
+
+        # Guess types of parameters
+        for name, param in self._parameters.items():
+            if name not in self._types:
+                self._types[name] = _guess_eltype(param)
+
+        # Guess types of evaluables
+        self._evaluated = None
+        if any(name not in self._types for name in self._evaluables):
+            for name, tp in self._guess_evaluable_types(casedata).items():
+                if name not in self._types:
+                    self._types[name] = tp
+
+        # Fill in types derived from commands
+        for cmd in self._commands:
+            cmd.add_types(self._types)
+
+        # Construct numpy dtype of result array
+        self._dtype = [(key, _numpy_dtype(tp)) for key, tp in self._types.items()]
+        categories = {
+            name: list(map(str, param)) for name, param in self._parameters.items()
+            if self._types[name] is str
+        }
+        self._store = ResultStore(self.storagepath / 'results', self.shape, self._dtype, categories)
+        self._cache = ResultCache(self.storagepath / 'cache')
+        self._trace = Trace(self.storagepath / 'trace.jsonl')
+        self._artifacts = ArtifactStore(self.storagepath / 'artifacts')
+        self._stages = StageCache(self.storagepath / 'stages')
+        self._stage_locks = {}
+
+        # Read settings
+        settings = casedata.get('settings', {})
+        self._logdir = settings.get('logdir', None)
+        self._use_cache = settings.get('cache', True)
+        self._prefile_link = settings.get('prefile-link', 'copy')
+        self._workdir = settings.get('workdir', None)
+        self._cost = settings.get('cost', None)
+        if self._workdir is not None:
+            self._workdir = self.sourcepath / os.path.expandvars(os.path.expanduser(self._workdir))
+
+    def _guess_evaluable_types(self, casedata):
+        """Guess the types of evaluables from their values over the whole
+        grid.  The guesses are cached, keyed on the parameters and
+        evaluables, so that jobs running single points don't need to
+        evaluate the grid.
+        """
+        cachepath = self.storagepath / 'evaltypes.json'
+        digest = hashlib.sha256()
+        update_digest(digest, __version__, json.dumps(
+            [casedata.get('parameters', {}), self._evaluables], sort_keys=True, default=str,
+        ))
+        key = digest.hexdigest()
+
+        try:
+            with open(cachepath, 'r') as f:
+                cached = json.load(f)
+            if cached['key'] == key:
+                return {name: TYPES[tp] for name, tp in cached['types'].items()}
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+
+        types = {name: _guess_array_eltype(values) for name, values in self.evaluated().items()}
+        with NamedTemporaryFile('w', dir=self.storagepath, delete=False) as f:
+            json.dump({'key': key, 'types': {name: tp.__name__ for name, tp in types.items()}}, f)
+        os.replace(f.name, cachepath)
+        return types
+
+    def _input_identifiers(self):
+        """Return the names that the files set up in the work directory may
+        depend on.  If the contents of a template can't be determined in
+        advance, this is all parameters and evaluables.
+        """
+        names = set()
+        for filemap in self._pre_files:
+            names |= identifiers(filemap.source) | identifiers(filemap.target)
+            if not filemap.template:
+                continue
+            if not is_constant(filemap.source):
+                return set(self._parameters) | set(self._evaluables)
+            with open(self.sourcepath / render(filemap.source, {}), 'r') as f:
+                names |= identifiers(f.read())
+        return names
+
+    def clear_cache(self):
+        shutil.rmtree(self.storagepath)
+        self.storagepath.mkdir(parents=True, exist_ok=True)
+
+    def evaluated(self):
+        if self._evaluated is None:
+            from badger.evaluate import evaluate_grid
+            self._evaluated = evaluate_grid(self._parameters, self._evaluables, self.shape)
+        return self._evaluated
+
+    def evaluate_context(self, context, index):
+        from badger.evaluate import evaluate_grid, item
+        index = np.unravel_index(index, self.shape)
+        if self._evaluated is None:
+            # Unless the whole grid is needed anyway, evaluate the point on
+            # its own, over a grid of one
+            parameters = {name: [param[i]] for (name, param), i in zip(self._parameters.items(), index)}
+            evaluated = evaluate_grid(parameters, self._evaluables, (1,) * len(index))
+            for name, values in evaluated.items():
+                context[name] = item(values.ravel()[0])
+            return
+        for name, values in self._evaluated.items():
+            context[name] = item(np.broadcast_to(values, self.shape)[index])
+
+    @property
+    def shape(self):
+        return tuple(map(len, self._parameters.values()))
+
+    @contextmanager
+    def acquire_lock(self):
+        # The interprocess lock does not exclude other threads in the same
+        # process, so serialize those separately
+        with self._lock, InterProcessLock(self.storagepath / 'lockfile'):
+            yield
+
+    def _open_store(self):
+        """Create the result store if it doesn't match the case.  Stored
+        postfiles refer to points by flat index, so they are dropped along
+        with the old results.  The caller must hold the case lock.
+        """
+        if not self._store.exists():
+            self._store.create()
+            self._artifacts.clear_manifests()
+
+    def open_store(self):
+        with self.acquire_lock():
+            self._open_store()
+
+    def commit_result(self, index, collector, timings=None, retries=0):
+        if timings is None:
+            timings = Timings()
+        with ExitStack() as stack:
+            with timings.phase('lock'):
+                stack.enter_context(self.acquire_lock())
+            with timings.phase('commit'):
+                self._open_store()
+                self._store.commit(index, collector, retries)
+
+    def mark_failed(self, index, timings=None, status=FAILED, retries=0):
+        if timings is None:
+            timings = Timings()
+        with ExitStack() as stack:
+            with timings.phase('lock'):
+                stack.enter_context(self.acquire_lock())
+            with timings.phase('commit'):
+                self._open_store()
+                self._store.mark(index, status, retries)
+                self._artifacts.drop_manifest(index)
+
+    def mark_pending(self, indices):
+        with self.acquire_lock():
+            self._open_store()
+            self._store.mark(indices, PENDING)
+
+    def result_array(self):
+        return self._store.result_array()
+
+    def result_columns(self):
+        return self._store.columns()
+
+    def status_array(self):
+        return self._store.status_array()
+
+    def outcome_array(self):
+        return self._store.outcome_array()
+
+    def postfiles(self, index):
+        """Return the names of the stored postfiles of a point."""
+        return list(self._artifacts.manifest(index))
+
+    def open_postfile(self, index, name):
+        return self._artifacts.open(index, name)
+
+    def pending(self):
+        return np.flatnonzero(self._store.status_array().ravel() == PENDING).tolist()
+
+    def leases(self, timeout=60.0):
+        return Leases(self.storagepath / 'leases', self.acquire_lock, timeout)
+
+    def status(self, timeout=60.0):
+        status = self._store.status_array()
+        npending = int(np.count_nonzero(status == PENDING))
+        nclaimed, nabandoned = self.leases(timeout).counts()
+        return {
+            'total': status.size,
+            'done': int(np.count_nonzero(status == SUCCESS)),
+            'failed': int(np.count_nonzero(status == FAILED)),
+            'timed-out': int(np.count_nonzero(status == TIMEOUT)),
+            'retried': int(np.count_nonzero(self._store.retries_array())),
+            'claimed': nclaimed,
+            'abandoned': nabandoned,
+            'unclaimed': npending - nclaimed - nabandoned,
+        }
+
+    def profile(self, slowest=5):
+        return summarize(self._trace.records(), slowest)
+
+    def check(self):
+        if self._logdir is None:
+            log.warning("Warning: logdir is not set; no stdout/stderr will be captured")
+
+    def parameters(self):
+        return ParameterSpace(self._parameters)
+
+    def coordinates(self):
+        """Return the values of each parameter along its axis."""
+        return {name: list(param) for name, param in self._parameters.items()}
+
+    def predicted_costs(self):
+        """Predict the cost of every point from the walltimes of earlier
+        runs and the cost expression, as a flat array, or None if there is
+        nothing to predict from.  Return also whether the costs are in
+        seconds.
+        """
+        fields = [cmd.name for cmd in self._commands if cmd._capture_walltime]
+        if not fields and self._cost is None:
+            return None, False
+        measured = np.full(int(np.prod(self.shape, dtype=int)), np.nan)
+        if fields:
+            data = self.result_array().ravel()
+            valid = self.status_array().ravel() == SUCCESS
+            total = np.zeros(measured.shape)
+            for name in fields:
+                valid &= ~np.ma.getmaskarray(data[name])
+                total += data[name].filled(0)
+            measured[valid] = total[valid]
+
+        estimate = None
+        if self._cost is not None:
+            from badger.evaluate import evaluate_grid
+            value = evaluate_grid(self._parameters, {**self._evaluables, '__cost__': self._cost}, self.shape)['__cost__']
+            estimate = np.broadcast_to(value, self.shape).astype(float).ravel()
+        return predict(measured, estimate)
+
+    def select(self, resume=False, shard=None):
+        """Return the points to run, in the order of the grid."""
+        parameters = self.parameters()
+        if shard:
+            parameters = parameters.shard(*shard)
+        if resume:
+            indices = parameters.index_array()
+            status = self._store.status_array().ravel()[indices]
+            nskipped = int(np.count_nonzero(status == SUCCESS))
+            parameters = parameters.subset(indices[status != SUCCESS])
+            log.info(f"skipping {nskipped} completed points")
+        return parameters
+
+    def plan(self, jobs=1, resume=False, shard=None):
+        """Predict the total runtime of a run, and its makespan on *jobs*
+        workers, both longest first and in the order of the grid.
+        """
+        indices = self.select(resume, shard).index_array()
+        costs, seconds = self.predicted_costs()
+        if costs is None:
+            costs = np.ones(int(np.prod(self.shape, dtype=int)))
+        return {
+            'points': len(indices),
+            'seconds': seconds,
+            'total': float(costs[indices].sum()),
+            'makespan': makespan(costs[longest_first(indices, costs)], jobs),
+            'makespan-in-order': makespan(costs[indices], jobs),
+        }
+
+    def run(self, jobs=1, resume=False, shard=None, backend=None):
+        self.check()
+        self.evaluated()
+
+        # Dispatch the longest points first, so that none is left running
+        # alone at the end.  Without differences in cost, the grid order
+        # is kept, along with the lazy range of indices.
+        parameters = self.select(resume, shard)
+        costs, _ = self.predicted_costs()
+        if costs is not None and costs.size and costs.min() < costs.max():
+            parameters = parameters.subset(longest_first(parameters.index_array(), costs))
+
+        # Postfiles are stored before points are committed, so a store that
+        # doesn't match the case must be replaced before anything runs
+        self.open_store()
+        if not resume:
+            self._trace.clear()
+        if backend is None:
+            backend = LocalBackend(jobs)
+        try:
+            nsuccess = backend.run(self, parameters)
+        finally:
+            self.close()
+
+        logger = log.info if nsuccess == len(parameters) else log.warning
+        logger(f"{nsuccess} of {len(parameters)} succeeded")
+
+    def run_point(self, index):
+        """Run a single point by its flat index, as submitted by the batch
+        backend.
+        """
+        self.open_store()
+        with ExitStack() as stack:
+            stack.callback(self.close)
+            staging = self.stage(stack)
+            return self.run_single(index, self.parameters().context(index), staging)
+
+    def work(self, jobs=1, heartbeat=10.0, timeout=60.0):
+        """Run as one of possibly several workers sharing the storage
+        directory, claiming unfinished points until none are left.
+        """
+        self.check()
+        self.evaluated()
+
+        self.open_store()
+        leases = self.leases(timeout)
+        parameters = self.parameters()
+
+        def run_point(index, staging):
+            try:
+                # The point may have finished since it was found to be pending
+                if self._store.status(index) != PENDING:
+                    return None
+                return self.run_single(index, parameters.context(index), staging)
+            finally:
+                leases.release(index)
+
+        nrun = nsuccess = 0
+        with ExitStack() as stack:
+            stack.callback(self.close)
+            staging = self.stage(stack)
+            stack.enter_context(leases.heartbeat(heartbeat))
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=jobs))
+            claims = ((index, staging) for index in leases.claims(self.pending, interval=heartbeat))
+            futures = stack.enter_context(closing(dispatch(executor, run_point, claims, window=jobs)))
+            for future in log.iter.plain('point', futures):
+                success = future.result()
+                if success is not None:
+                    nrun += 1
+                    nsuccess += success
+
+        logger = log.info if nsuccess == nrun else log.warning
+        logger(f"{nsuccess} of {nrun} succeeded")
+
+    def close(self):
+        """Stop the persistent commands started by running points."""
+        for command in self._commands:
+            command.close()
+
+    def workdir(self):
+        if self._workdir is not None:
+            self._workdir.mkdir(parents=True, exist_ok=True)
+        return TemporaryDirectory(dir=self._workdir)
+
+    def stage(self, stack):
+        """Stage prefiles that are the same for all points once, if they are
+        to be linked into the work directories.  Others are staged as they
+        are first needed.  The staging area lives as long as the given exit
+        stack.
+        """
+        if self._prefile_link == 'copy':
+            return None
+        staging = Staging(Path(stack.enter_context(self.workdir())))
+        for filemap in self._pre_files:
+            if not filemap.template and is_constant(filemap.source):
+                staging.stage(self.sourcepath / render(filemap.source, {}))
+        return staging
+
+    def prepare(self, index, namespace, staging=None):
+        """Evaluate the context of a point, and set up its work directory.
+        If the point is found in the cache, its results are collected
+        immediately.
+        """
+        timings = Timings()
+        with timings.phase('evaluate'):
+            self.evaluate_context(namespace, index)
+            collector = ResultCollector(self._types)
+            for key, value in namespace.items():
+                collector.collect(key, value)
+
+        with timings.phase('workdir'):
+            point = Point(index, namespace, collector, self.workdir(), timings)
+        try:
+            if self._logdir:
+                point.logdir = self.storagepath / render(self._logdir, namespace)
+                point.logdir.mkdir(parents=True, exist_ok=True)
+
+            # The rendered templates and identities of the prefiles are
+            # part of the keys of both the cache and memoized commands
+            inputs = hashlib.sha256()
+            for filemap in self._pre_files:
+                with timings.phase('render' if filemap.template else 'copy'):
+                    filemap.copy(namespace, self.sourcepath, point.workpath, digest=inputs, link=self._prefile_link, staging=staging)
+            point.inputs = inputs.hexdigest()
+
+            if self._use_cache:
+                digest = inputs.copy()
+                with timings.phase('fingerprint'):
+                    for command in self._commands:
+                        command.fingerprint(digest, namespace, point.workpath)
+                    for filemap in self._post_files:
+                        update_digest(digest, render(filemap.source, namespace), render(filemap.target, namespace))
+                    point.key = digest.hexdigest()
+                    cached = self._cache.get(point.key)
+                if cached is not None:
+                    log.debug(f"reusing cached result {point.key}")
+                    for name, value in cached.items():
+                        collector.collect(name, value)
+                    point.cached = True
+        except BaseException:
+            point.cleanup()
+            raise
+
+        return point
+
+    def execute(self, point):
+        if point.cached:
+            return True
+        try:
+            for command in self._commands:
+                if command.depends is not None:
+                    status, retries = self.run_memoized(command, point)
+                else:
+                    status, retries = command.run(point.collector, point.namespace, point.workpath, point.logdir, point.timings)
+                point.retries += retries
+                if status != SUCCESS:
+                    point.status = status
+                    return False
+        except BaseException:
+            point.cleanup()
+            raise
+        return True
+
+    def run_memoized(self, command, point):
+        """Run a command that depends only on some parameters and evaluables,
+        once for each distinct combination of their values.  Its captured
+        values and the files it writes are stored, and reused by every
+        point sharing that combination.  The combination also covers the
+        files set up in the work directory and the commands up to this
+        one, since those determine what the command finds there.
+        """
+        digest = hashlib.sha256()
+        update_digest(digest, point.inputs)
+        for earlier in self._commands:
+            earlier.fingerprint(digest, point.namespace, point.workpath)
+            if earlier is command:
+                break
+        for name in sorted(command.depends):
+            update_digest(digest, name, repr(point.namespace[name]))
+        key = digest.hexdigest()
+
+        # Points sharing a combination wait for the first to finish, rather
+        # than running the command again
+        lock = self._stage_locks.setdefault(key, Lock())
+        with lock, InterProcessLock(self._stages.lockpath(key)):
+            cached = self._stages.get(key)
+            if cached is None:
+                collector = ResultCollector(self._types)
+                before = snapshot(point.workpath)
+                status, retries = command.run(collector, point.namespace, point.workpath, point.logdir, point.timings)
+                if status != SUCCESS:
+                    return status, retries
+                files = [path for path, ident in snapshot(point.workpath).items() if before.get(path) != ident]
+                self._stages.put(key, dict(collector), point.workpath, files)
+                point.collector.update(collector)
+                return status, retries
+
+        values, filespath = cached
+        log.debug(f"reusing outputs of command {command.name} ({key})")
+        with point.timings.phase(f'{command.name}:reuse'):
+            for path in filespath.rglob('*'):
+                if not path.is_file():
+                    continue
+                target = point.workpath / path.relative_to(filespath)
+                target.parent.mkdir(parents=True, exist_ok=True)
+                target.unlink(missing_ok=True)
+                provision(path, target, self._prefile_link)
+        for name, value in values.items():
+            point.collector.collect(name, value)
+        return SUCCESS, 0
+
+    def finish(self, point, success):
+        timings = point.timings
+        try:
+            if success and self._post_files:
+                with timings.phase('postfiles'):
+                    self.collect_postfiles(point)
+            if success and point.key and not point.cached:
+                with timings.phase('cache'):
+                    self._cache.put(point.key, {
+                        name: value for name, value in point.collector.items()
+                        if name not in point.namespace
+                    })
+                    if self._post_files:
+                        self._cache.put(f'{point.key}-postfiles', self._artifacts.manifest(point.index))
+            if success:
+                self.commit_result(point.index, point.collector, timings, point.retries)
+            else:
+                self.mark_failed(point.index, timings, point.status, point.retries)
+        finally:
+            with timings.phase('cleanup'):
+                point.cleanup()
+        self._trace.record(point.index, timings, success=success, cached=point.cached, retries=point.retries)
+        return success
+
+    def collect_postfiles(self, point):
+        """Store the postfiles of a point.  Points found in the cache reuse
+        the files of the run they were cached from.
+        """
+        manifest = None
+        if point.cached:
+            manifest = self._cache.get(f'{point.key}-postfiles')
+        if manifest is None:
+            manifest = {}
+            for filemap in self._post_files:
+                filemap.collect(point.namespace, point.workpath, self._artifacts, manifest)
+        self._artifacts.put_manifest(point.index, manifest)
+
+    def run_single(self, index, namespace, staging=None):
+        point = self.prepare(index, namespace, staging)
+        return self.finish(point, self.execute(point))
@@ -0,0 +1,135 @@
+import ast
+import operator as op
+
+import numpy as np
+from simpleeval import SimpleEval, safe_add, safe_lshift, safe_mult, safe_power, safe_rshift
+
+
+def _elementwise(func, numeric=None):
+    """Wrap a binary operator so that it applies elementwise to arrays.
+    Operands of numeric type may use a faster numpy implementation,
+    otherwise the operator is called for each element, with all its
+    safety checks intact.
+    """
+    pyfunc = np.frompyfunc(func, 2, 1)
+    def apply(a, b):
+        if numeric and np.asarray(a).dtype != object and np.asarray(b).dtype != object:
+            return numeric(a, b)
+        return pyfunc(a, b)
+    return apply
+
+
+VECTOR_OPERATORS = {
+    ast.Add: _elementwise(safe_add, np.add),
+    ast.Sub: op.sub,
+    ast.Mult: _elementwise(safe_mult, np.multiply),
+    ast.Div: op.truediv,
+    ast.FloorDiv: op.floordiv,
+    ast.RShift: _elementwise(safe_rshift),
+    ast.LShift: _elementwise(safe_lshift),
+    ast.Pow: _elementwise(safe_power),
+    ast.Mod: op.mod,
+    ast.USub: op.neg,
+    ast.UAdd: op.pos,
+    ast.BitXor: op.xor,
+    ast.BitOr: op.or_,
+    ast.BitAnd: op.and_,
+    ast.Invert: op.invert,
+}
+
+# Only pure arithmetic is evaluated on whole arrays.  Anything else (calls,
+# comparisons, conditionals, ...) is evaluated point by point.
+VECTOR_NODES = (
+    ast.Expression, ast.Name, ast.Load, ast.Constant,
+    ast.BinOp, ast.UnaryOp, ast.operator, ast.unaryop,
+)
+
+
+def parameter_array(values):
+    """Convert parameter values to an array.  Only floats are converted to
+    a numeric dtype, everything else is kept as Python objects so that
+    arithmetic has the same semantics as for single points.
+    """
+    if all(isinstance(v, float) for v in values):
+        return np.array(values, dtype=float)
+    array = np.empty((len(values),), dtype=object)
+    array[:] = list(values)
+    return array
+
+
+def item(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _evaluate_vectorized(code, names, shape):
+    evaluator = SimpleEval(operators=VECTOR_OPERATORS)
+    evaluator.names = names
+    try:
+        with np.errstate(all='raise'):
+            value = evaluator.eval(code)
+    except Exception:
+        return None
+    if not isinstance(value, np.ndarray):
+        array = np.empty((), dtype=object)
+        array[()] = value
+        value = array
+    if value.shape != shape:
+        return None
+    return value
+
+
+def _evaluate_pointwise(code, names, shape):
+    views = {name: np.broadcast_to(names[name], shape) for name in names}
+    values = np.empty(shape, dtype=object)
+    evaluator = SimpleEval()
+    for index in np.ndindex(*shape):
+        evaluator.names = {name: item(view[index]) for name, view in views.items()}
+        values[index] = evaluator.eval(code)
+    return values
+
+
+def evaluate_grid(parameters, evaluables, shape):
+    """Evaluate all evaluables over the grid of parameter values.
+
+    Each parameter is an array along its own axis, and evaluables are
+    computed with numpy broadcasting, so each result only extends along
+    the axes of the parameters it depends on.  The returned arrays can be
+    broadcast to the full shape of the grid.
+
+    Expressions that can't be vectorized are evaluated point by point with
+    SimpleEval: over the axes they depend on, or over the whole grid if
+    they call functions, which may not be deterministic.
+    """
+    names = {}
+    for axis, (name, param) in enumerate(parameters.items()):
+        axes = [1] * len(shape)
+        axes[axis] = len(param)
+        names[name] = parameter_array(param).reshape(axes)
+
+    for name, code in evaluables.items():
+        if not isinstance(code, str):
+            value = np.empty((), dtype=object)
+            value[()] = code
+            names[name] = value
+            continue
+
+        tree = ast.parse(code.strip(), mode='eval')
+        nodes = list(ast.walk(tree))
+        refs = {node.id for node in nodes if isinstance(node, ast.Name) and node.id in names}
+        local = {ref: names[ref] for ref in refs}
+        subshape = np.broadcast_shapes(*(names[ref].shape for ref in refs))
+
+        value = None
+        if all(isinstance(node, VECTOR_NODES) for node in nodes):
+            value = _evaluate_vectorized(code, local, subshape)
+        if value is None:
+            if any(isinstance(node, ast.Call) for node in nodes):
+                local, subshape = names, tuple(shape)
+            value = _evaluate_pointwise(code, local, subshape)
+
+        # Pad to the full number of dimensions
+        names[name] = value.reshape((1,) * (len(shape) - value.ndim) + value.shape)
+
+    return {name: names[name] for name in evaluables}
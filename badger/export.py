@@ -0,0 +1,186 @@
+import csv
+import zipfile
+
+import numpy as np
+
+
+EXPORT_CHUNK_SIZE = 1 << 16
+
+EXTENSIONS = {
+    '.npz': 'npz',
+    '.csv': 'csv',
+    '.h5': 'hdf5',
+    '.hdf5': 'hdf5',
+    '.parquet': 'parquet',
+}
+
+
+def _plain(values, mask, strings):
+    """Convert a chunk of a stored field to a plain array, without Python
+    objects, with invalid entries zeroed or empty.  String fields are
+    decoded from their codes.
+    """
+    valid = ~np.asarray(mask)
+    if strings is None:
+        return np.where(valid, values, 0), valid
+    table = np.array(strings or [''], dtype=str)
+    return np.where(valid, table[np.where(valid, values, 0)], ''), valid
+
+
+def _layout(case):
+    """Return the coordinates of each axis, and the stored fields that are
+    not coordinates, as flat values, mask and strings.  The values and
+    mask are memory mapped, so nothing is read until it's exported.
+    """
+    coords = {name: np.asarray(values) for name, values in case.coordinates().items()}
+    columns = {name: column for name, column in case.result_columns().items() if name not in coords}
+    return coords, columns
+
+
+def _field(column, shape):
+    """Return one field as a plain array of the given shape, and its
+    validity, decoding it a chunk at a time.
+    """
+    values, mask, strings = column
+    size = len(values)
+    data = valid = None
+    for start in range(0, size, EXPORT_CHUNK_SIZE):
+        stop = min(start + EXPORT_CHUNK_SIZE, size)
+        chunk, ok = _plain(values[start:stop], mask[start:stop], strings)
+        if data is None:
+            data = np.empty((size,), dtype=chunk.dtype)
+            valid = np.empty((size,), dtype=bool)
+        elif chunk.dtype.itemsize > data.dtype.itemsize:
+            data = data.astype(chunk.dtype)
+        data[start:stop] = chunk
+        valid[start:stop] = ok
+    if data is None:
+        data, valid = _plain(values[:0], mask[:0], strings)
+    return data.reshape(shape), valid.reshape(shape)
+
+
+def _rows(coords, columns, shape):
+    """Yield chunks of the results in long form, as a dict of flat arrays:
+    the flat index of each point, its coordinates, and each column with
+    its validity.
+    """
+    size = int(np.prod(shape, dtype=int))
+    for start in range(0, size, EXPORT_CHUNK_SIZE):
+        stop = min(start + EXPORT_CHUNK_SIZE, size)
+        index = np.arange(start, stop)
+        multi = np.unravel_index(index, shape)
+        chunk = {'index': (index, None)}
+        for (name, values), i in zip(coords.items(), multi):
+            chunk[name] = (values[i], None)
+        for name, (values, mask, strings) in columns.items():
+            chunk[name] = _plain(values[start:stop], mask[start:stop], strings)
+        yield chunk
+
+
+def export_npz(case, path):
+    """Write one array per field, with the validity of each field in
+    'valid/<field>' and the axes in 'coords/<parameter>'.  No array needs
+    pickling, and each can be loaded on its own.  Fields are written one
+    at a time.
+    """
+    coords, columns = _layout(case)
+    with zipfile.ZipFile(path, 'w') as archive:
+        def write(name, array):
+            with archive.open(f'{name}.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+
+        write('axes', np.array(list(coords), dtype=str))
+        for name, values in coords.items():
+            write(f'coords/{name}', values)
+        for name, column in columns.items():
+            values, valid = _field(column, case.shape)
+            write(name, values)
+            write(f'valid/{name}', valid)
+
+
+def export_hdf5(case, path):
+    """Write one dataset per field, with the axes attached as dimension
+    scales, and the validity of each field in 'valid/<field>'.  Fields
+    are written one at a time.
+    """
+    import h5py
+
+    coords, columns = _layout(case)
+    with h5py.File(path, 'w') as f:
+        scales = []
+        for name, values in coords.items():
+            if values.dtype.kind == 'U':
+                values = values.astype(h5py.string_dtype())
+            dataset = f.create_dataset(f'coords/{name}', data=values)
+            dataset.make_scale(name)
+            scales.append(dataset)
+
+        for name, column in columns.items():
+            values, valid = _field(column, case.shape)
+            if values.dtype.kind == 'U':
+                values = values.astype(h5py.string_dtype())
+            for group, data in (('', values), ('valid/', valid)):
+                dataset = f.create_dataset(f'{group}{name}', data=data)
+                for axis, scale in enumerate(scales):
+                    dataset.dims[axis].attach_scale(scale)
+
+
+def export_csv(case, path):
+    """Write one row per point, with the flat index and coordinates of the
+    point first.  Invalid values are left empty.
+    """
+    coords, columns = _layout(case)
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['index', *coords, *columns])
+        for chunk in _rows(coords, columns, case.shape):
+            cells = []
+            for values, valid in chunk.values():
+                values = values.tolist()
+                if valid is not None:
+                    values = [value if ok else '' for value, ok in zip(values, valid.tolist())]
+                cells.append(values)
+            writer.writerows(zip(*cells))
+
+
+def export_parquet(case, path):
+    """Write one row per point, with the flat index and coordinates of the
+    point first.  Invalid values are stored as nulls.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    coords, columns = _layout(case)
+    writer = None
+    try:
+        for chunk in _rows(coords, columns, case.shape):
+            table = pa.table({
+                name: pa.array(values, mask=None if valid is None else ~valid)
+                for name, (values, valid) in chunk.items()
+            })
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+EXPORTERS = {
+    'npz': export_npz,
+    'csv': export_csv,
+    'hdf5': export_hdf5,
+    'parquet': export_parquet,
+}
+
+
+def export(case, path, format=None):
+    """Export the results of a case.  The format is guessed from the file
+    extension if not given.  HDF5 and Parquet require h5py and pyarrow.
+    """
+    if format is None:
+        try:
+            format = EXTENSIONS[path.suffix.lower()]
+        except KeyError:
+            raise ValueError(f"unknown export format for {path.name}")
+    EXPORTERS[format](case, path)
@@ -0,0 +1,150 @@
+from contextlib import contextmanager
+import os
+import socket
+from threading import Event, Lock, Thread
+import time
+from uuid import uuid4
+
+
+class Leases:
+    """Claims on parameter points, shared between workers through lease
+    files in a common directory.  A lease is kept alive by touching its
+    file regularly, and a lease that hasn't been touched for longer than
+    the timeout is considered abandoned and may be claimed by another
+    worker.
+
+    Modification times are compared with the clock of the file system
+    holding the leases, not the local clock, so workers on different
+    hosts agree on what has expired.
+    """
+
+    def __init__(self, path, lock, timeout=60.0):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._lock = lock
+        self._timeout = timeout
+        self._owner = f'{socket.gethostname()}:{os.getpid()}:{uuid4().hex}'
+        self._held = set()
+        self._held_lock = Lock()
+
+    def _leasepath(self, index):
+        return self.path / str(index)
+
+    def _clock(self):
+        clockpath = self.path / f'.clock-{self._owner}'
+        clockpath.touch()
+        try:
+            return clockpath.stat().st_mtime
+        finally:
+            clockpath.unlink()
+
+    def _expired(self, path, now):
+        try:
+            return now - path.stat().st_mtime > self._timeout
+        except FileNotFoundError:
+            return True
+
+    def _write(self, path):
+        tmppath = self.path / f'.{path.name}-{self._owner}'
+        with open(tmppath, 'w') as f:
+            f.write(self._owner)
+        os.replace(tmppath, path)
+
+    def claim(self, index):
+        path = self._leasepath(index)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # Take over abandoned leases under the case lock, so that only
+            # one worker can do so
+            with self._lock():
+                if not self._expired(path, self._clock()):
+                    return False
+                self._write(path)
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self._owner)
+
+        with self._held_lock:
+            self._held.add(index)
+        return True
+
+    def _owned(self, path):
+        try:
+            with open(path, 'r') as f:
+                return f.read() == self._owner
+        except FileNotFoundError:
+            return False
+
+    def _lost(self, index):
+        with self._held_lock:
+            self._held.discard(index)
+
+    def release(self, index):
+        self._lost(index)
+        # The lease may have been taken over by another worker, which
+        # happens under the case lock
+        with self._lock():
+            path = self._leasepath(index)
+            if self._owned(path):
+                path.unlink()
+
+    def renew(self):
+        with self._held_lock:
+            held = list(self._held)
+        if not held:
+            return
+        with self._lock():
+            for index in held:
+                path = self._leasepath(index)
+                if self._owned(path):
+                    os.utime(path)
+                else:
+                    self._lost(index)
+
+    @contextmanager
+    def heartbeat(self, interval):
+        """Renew all held leases every *interval* seconds while active."""
+        stop = Event()
+        def beat():
+            while not stop.wait(interval):
+                self.renew()
+        thread = Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def claims(self, candidates, interval):
+        """Claim and yield points from *candidates*, a callable returning the
+        indices of unfinished points.  Points leased by other workers are
+        polled every *interval* seconds, until they are finished or their
+        leases expire.
+        """
+        while True:
+            claimed = waiting = False
+            for index in candidates():
+                if self.claim(index):
+                    claimed = True
+                    yield index
+                else:
+                    waiting = True
+            if not waiting:
+                return
+            if not claimed:
+                time.sleep(interval)
+
+    def counts(self):
+        """Return the number of live and expired leases."""
+        now = self._clock()
+        live = expired = 0
+        for path in self.path.iterdir():
+            if path.name.startswith('.'):
+                continue
+            if self._expired(path, now):
+                expired += 1
+            else:
+                live += 1
+        return live, expired
@@ -0,0 +1,48 @@
+import heapq
+
+import numpy as np
+
+
+def predict(measured, estimate=None):
+    """Predict the cost of each point from *measured* walltimes, with NaN
+    where none are known, and an optional *estimate* from the cost
+    expression.  Return the predicted costs and whether they are in
+    seconds.
+
+    Measured points keep their walltimes.  The others get their estimate,
+    scaled by the median ratio of walltime to estimate over the points
+    that have both, or the mean walltime if there is no estimate.
+    """
+    measured = np.asarray(measured, dtype=float)
+    known = ~np.isnan(measured)
+
+    if estimate is None:
+        if not known.any():
+            return np.ones_like(measured), False
+        return np.where(known, measured, measured[known].mean()), True
+
+    estimate = np.asarray(estimate, dtype=float)
+    calibrate = known & (estimate > 0)
+    if not calibrate.any():
+        return estimate, False
+    scale = np.median(measured[calibrate] / estimate[calibrate])
+    return np.where(known, measured, scale * estimate), True
+
+
+def longest_first(indices, costs):
+    """Order flat indices by decreasing cost, as an array.  Ties keep their
+    order.
+    """
+    indices = np.asarray(indices, dtype=int)
+    order = np.argsort(-costs[indices], kind='stable')
+    return indices[order]
+
+
+def makespan(costs, jobs=1):
+    """Return the time to run points of the given costs in order, each
+    starting on the first of *jobs* workers to become free.
+    """
+    workers = [0.0] * jobs
+    for cost in costs:
+        heapq.heapreplace(workers, workers[0] + float(cost))
+    return max(workers)
@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+import json
+import os
+from threading import Lock
+from time import perf_counter
+
+import numpy as np
+
+
+PERCENTILES = (50, 90, 99)
+
+
+class Timings(dict):
+    """Time spent in each phase of running a point, in seconds.  Repeated
+    phases accumulate.
+    """
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start)
+
+    def add(self, name, duration):
+        self[name] = self.get(name, 0.0) + duration
+
+
+def is_overhead(phase):
+    """Everything except the runtime of commands is overhead."""
+    return not phase.endswith(':run')
+
+
+class Trace:
+    """Append-only log of per-point timings, one JSON record per line.
+    Each record is written with a single call in append mode, so records
+    from concurrent processes don't interleave.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+
+    def clear(self):
+        if self.path.exists():
+            self.path.unlink()
+
+    def record(self, index, timings, **extra):
+        line = json.dumps({'index': index, **extra, 'phases': timings}) + '\n'
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line.encode())
+            finally:
+                os.close(fd)
+
+    def records(self):
+        if not self.path.exists():
+            return []
+        with open(self.path, 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records, slowest=5):
+    """Summarize trace records as per-phase statistics, the slowest points
+    and the fraction of time spent outside of commands.
+    """
+    phases = {}
+    for record in records:
+        for name, duration in record['phases'].items():
+            phases.setdefault(name, []).append(duration)
+
+    stats = {}
+    for name, durations in phases.items():
+        durations = np.array(durations)
+        stats[name] = {
+            'count': len(durations),
+            'total': float(durations.sum()),
+            **{f'p{q}': float(np.percentile(durations, q)) for q in PERCENTILES},
+            'max': float(durations.max()),
+        }
+
+    totals = [(sum(record['phases'].values()), record) for record in records]
+    totals.sort(key=lambda pair: pair[0], reverse=True)
+
+    total = sum(stat['total'] for stat in stats.values())
+    overhead = sum(stat['total'] for name, stat in stats.items() if is_overhead(name))
+    return {
+        'phases': stats,
+        'slowest': [{'total': t, **record} for t, record in totals[:slowest]],
+        'total': total,
+        'overhead': overhead / total if total else 0.0,
+    }
@@ -1,7 +1,6 @@
+from functools import lru_cache
 import shlex
 
-from mako.template import Template
-
 
 def quote_shell(text):
     return shlex.quote(text)
@@ -18,12 +17,39 @@ QUOTERS = {
 }
 
 
-def render(text, context, mode=None):
+@lru_cache(maxsize=1024)
+def compile_template(text, mode=None):
+    # Mako is slow to import, and not needed by every command
+    from mako.template import Template
     filters = ['str']
     imports = []
     if mode is not None:
         filters.append(f'quote_{mode}')
         imports.append(f'from badger.render import quote_{mode}')
+    return Template(text, default_filters=filters, imports=imports)
+
 
-    template = Template(text, default_filters=filters, imports=imports)
+def render(text, context, mode=None):
+    template = compile_template(text, mode)
     return template.render(**context, rnd=rnd, sci=sci)
+
+
+def is_constant(text):
+    """Check whether a template renders the same regardless of context."""
+    from mako.lexer import Lexer
+    from mako import parsetree
+    nodes = Lexer(text).parse().nodes
+    return all(isinstance(node, (parsetree.Text, parsetree.Comment)) for node in nodes)
+
+
+def identifiers(text):
+    """Return the names that a template may look up in its context."""
+    from mako.lexer import Lexer
+    names = set()
+    def walk(nodes):
+        for node in nodes:
+            if hasattr(node, 'undeclared_identifiers'):
+                names.update(node.undeclared_identifiers())
+            walk(getattr(node, 'nodes', ()))
+    walk(Lexer(text).parse().nodes)
+    return names
@@ -0,0 +1,65 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import subprocess
+import time
+from uuid import uuid4
+
+import treelog as log
+
+
+class LocalQueue:
+    """A minimal batch scheduler for testing the batch backend without a
+    cluster.  Submitted array jobs are files in a queue directory, each
+    listing the scripts of its tasks, and are consumed by a serving
+    process.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def submit(self, listfile):
+        """Queue the scripts listed in a file as an array job, and return
+        its job id.
+        """
+        jobid = f'{time.time_ns()}-{uuid4().hex[:8]}'
+        tmppath = self.path / f'.{jobid}'
+        with open(listfile, 'r') as f, open(tmppath, 'w') as g:
+            g.write(f.read())
+        os.replace(tmppath, self.path / f'{jobid}.job')
+        return jobid
+
+    def _take(self):
+        """Claim the oldest queued job, if any."""
+        for path in sorted(self.path.glob('*.job')):
+            running = path.with_suffix('.running')
+            try:
+                os.rename(path, running)
+            except FileNotFoundError:
+                # Taken by another serving process
+                continue
+            return running
+        return None
+
+    def serve(self, jobs=1, interval=1.0, idle=None):
+        """Run queued jobs, with up to *jobs* tasks at once.  Return after
+        the queue has been empty for *idle* seconds, or never if None.
+        """
+        last = time.monotonic()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            while True:
+                path = self._take()
+                if path is None:
+                    if idle is not None and time.monotonic() - last > idle:
+                        return
+                    time.sleep(interval)
+                    continue
+
+                with open(path, 'r') as f:
+                    scripts = [line.strip() for line in f if line.strip()]
+                log.info(f"running job {path.stem} with {len(scripts)} tasks")
+                for script in scripts:
+                    executor.submit(subprocess.run, ['sh', script], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                executor.submit(path.unlink)
+                last = time.monotonic()
@@ -128,10 +128,30 @@ CASE_SCHEMA = Map({
             Optional('capture'): Str() | Regex() | Seq(Str() | Regex()),
             Optional('capture-output'): Bool(),
             Optional('capture-walltime'): Bool(),
+            Optional('capture-resources'): Bool(),
+            Optional('stream'): Bool(),
+            Optional('timeout'): Float(),
+            Optional('retries'): Int(),
+            Optional('retry-backoff'): Float(),
+            Optional('depends'): Literal('auto') | Seq(Str()),
+            Optional('persistent'): Bool(),
+            Optional('input'): Str(),
+        }),
+        Map({
+            'function': Str(),
+            Optional('name'): Str(),
+            Optional('capture-walltime'): Bool(),
+            Optional('retries'): Int(),
+            Optional('retry-backoff'): Float(),
+            Optional('depends'): Literal('auto') | Seq(Str()),
         }),
     )),
     Optional('settings'): Map({
         Optional('logdir'): Str(),
+        Optional('cache'): Bool(),
+        Optional('workdir'): Str(),
+        Optional('prefile-link'): Choice('copy', 'hardlink', 'reflink', 'symlink'),
+        Optional('cost'): Str(),
     }),
     Optional('types'): MapPattern(Str(), Type()),
 })
@@ -0,0 +1,427 @@
+from functools import partial
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import stat
+from tempfile import NamedTemporaryFile, mkdtemp
+
+import numpy as np
+import numpy.ma as ma
+from numpy.lib.format import open_memmap
+import treelog as log
+
+
+PENDING = 0
+SUCCESS = 1
+FAILED = 2
+TIMEOUT = 3
+
+OUTCOMES = {
+    PENDING: 'pending',
+    SUCCESS: 'ok',
+    FAILED: 'failed',
+    TIMEOUT: 'timed-out',
+}
+
+# Incremented when the files making up a store change
+STORE_VERSION = 3
+
+# Type of the codes of dictionary-encoded string fields
+STRING_CODE = np.int32
+
+ARTIFACT_CHUNK_SIZE = 1 << 20
+
+
+class StringTable:
+    """Interning table for the string fields of a result store, mapping
+    each distinct string of a field to an integer code.  Codes are assigned
+    in order of appearance, and the table is shared between processes
+    through a log file that is only appended to under the case lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._reset()
+
+    def _reset(self):
+        self._strings = {}
+        self._codes = {}
+        self._offset = 0
+
+    def _add(self, name, string):
+        strings = self._strings.setdefault(name, [])
+        self._codes.setdefault(name, {})[string] = len(strings)
+        strings.append(string)
+
+    def sync(self):
+        """Read entries added since the last call, possibly by other
+        processes.
+        """
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            self._reset()
+            return
+        if size < self._offset:
+            self._reset()
+        with open(self.path, 'rb') as f:
+            f.seek(self._offset)
+            for line in f:
+                # Skip a line that is still being written
+                if not line.endswith(b'\n'):
+                    break
+                self._offset += len(line)
+                self._add(*json.loads(line))
+
+    def encode(self, name, strings):
+        """Return the codes of strings of a field, adding any new ones to the
+        table.  The caller must hold the case lock.
+        """
+        self.sync()
+        codes = self._codes.get(name, {})
+        new = []
+        for string in strings:
+            if string not in codes:
+                self._add(name, string)
+                codes = self._codes[name]
+                new.append(string)
+        if new:
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps([name, string]) + '\n' for string in new))
+            self._offset = self.path.stat().st_size
+        return [codes[string] for string in strings]
+
+    def strings(self, name):
+        self.sync()
+        return list(self._strings.get(name, []))
+
+
+class ResultStore:
+    """Incremental storage for the result array of a case.
+
+    All fields are kept in a flat memory-mapped structured array, so that
+    committing a single point only touches its own records. String fields
+    are dictionary-encoded: the array holds integer codes, and the strings
+    themselves are interned in a side table.  String parameters, whose
+    values are known up front, are encoded by their position along their
+    axis.  No field needs pickling to be stored or loaded.
+
+    A per-field mask and a per-point status array mark what has been
+    committed, and the number of retries spent on each point is kept
+    alongside.
+    """
+
+    def __init__(self, path, shape, dtype, categories=None):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = int(np.prod(self.shape, dtype=int))
+        self._categories = categories or {}
+        self._table = StringTable(path / 'strings.jsonl')
+
+        self._strings = [name for name in self.dtype.names if self.dtype[name] == object]
+
+    @property
+    def _layout(self):
+        return {
+            'version': STORE_VERSION,
+            'shape': list(self.shape),
+            'fields': [[name, self.dtype[name].str] for name in self.dtype.names],
+            'categories': self._categories,
+        }
+
+    def _values_dtype(self):
+        return [
+            (name, STRING_CODE if name in self._strings else self.dtype[name])
+            for name in self.dtype.names
+        ]
+
+    def _mask_dtype(self):
+        return [(name, bool) for name in self.dtype.names]
+
+    def exists(self):
+        layoutpath = self.path / 'layout.json'
+        if not layoutpath.is_file():
+            return False
+        with open(layoutpath, 'r') as f:
+            return json.load(f) == self._layout
+
+    def create(self):
+        """Create an empty store, replacing any existing one.  The caller
+        must hold the case lock.
+        """
+        if (self.path / 'layout.json').is_file():
+            log.warning("Warning: stored results do not match the case; cached points will be reused")
+            (self.path / 'layout.json').unlink()
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        values = open_memmap(self.path / 'values.npy', mode='w+', dtype=self._values_dtype(), shape=(self.size,))
+        values.flush()
+        mask = open_memmap(self.path / 'mask.npy', mode='w+', dtype=self._mask_dtype(), shape=(self.size,))
+        mask[:] = np.ones((), dtype=self._mask_dtype())
+        mask.flush()
+        status = open_memmap(self.path / 'status.npy', mode='w+', dtype=np.uint8, shape=(self.size,))
+        status.flush()
+        retries = open_memmap(self.path / 'retries.npy', mode='w+', dtype=np.uint16, shape=(self.size,))
+        retries.flush()
+
+        with open(self.path / 'strings.jsonl', 'w'):
+            pass
+        for name, strings in self._categories.items():
+            self._table.encode(name, strings)
+
+        # The layout file is written last, and marks the store as complete
+        with open(self.path / 'layout.json', 'w') as f:
+            json.dump(self._layout, f)
+
+    def commit(self, index, collector, retries=0):
+        """Store the values of a single point.  The caller must hold the
+        case lock.
+        """
+        if not self.exists():
+            self.create()
+
+        values = open_memmap(self.path / 'values.npy', mode='r+')
+        mask = open_memmap(self.path / 'mask.npy', mode='r+')
+        for key, value in collector.items():
+            if key in self._strings:
+                value, = self._table.encode(key, [value])
+            values[key][index] = value
+            mask[key][index] = False
+        values.flush()
+        mask.flush()
+
+        self.mark(index, SUCCESS, retries)
+
+    def mark(self, index, status, retries=0):
+        """Set the status of a point, or a list of points.  The caller must
+        hold the case lock.
+        """
+        if not self.exists():
+            self.create()
+        array = open_memmap(self.path / 'retries.npy', mode='r+')
+        array[index] = retries
+        array.flush()
+        array = open_memmap(self.path / 'status.npy', mode='r+')
+        array[index] = status
+        array.flush()
+
+    def status(self, index):
+        if not self.exists():
+            return PENDING
+        return int(np.load(self.path / 'status.npy', mmap_mode='r')[index])
+
+    def status_array(self):
+        if not self.exists():
+            return np.full(self.shape, PENDING, dtype=np.uint8)
+        return np.load(self.path / 'status.npy').reshape(self.shape)
+
+    def retries_array(self):
+        if not self.exists():
+            return np.zeros(self.shape, dtype=np.uint16)
+        return np.load(self.path / 'retries.npy').reshape(self.shape)
+
+    def outcome_array(self):
+        """Return the outcome of each point as a string: 'pending', 'ok',
+        'failed', 'timed-out', or 'retried-n' for points that succeeded
+        after n retries.
+        """
+        status = self.status_array()
+        retries = self.retries_array()
+        outcomes = np.empty(self.shape, dtype=object)
+        for index, code in np.ndenumerate(status):
+            if code == SUCCESS and retries[index]:
+                outcomes[index] = f'retried-{retries[index]}'
+            else:
+                outcomes[index] = OUTCOMES[code]
+        return outcomes
+
+    def result_array(self):
+        if not self.exists():
+            return ma.array(
+                np.zeros(self.shape, dtype=self.dtype),
+                mask=np.ones(self.shape, dtype=bool)
+            )
+
+        # The string table is read last, so that it covers every code
+        # committed by the time the values are read
+        data = np.zeros((self.size,), dtype=self.dtype)
+        values = np.load(self.path / 'values.npy', mmap_mode='r')
+        mask = np.load(self.path / 'mask.npy')
+        for name in self.dtype.names:
+            if name not in self._strings:
+                data[name] = values[name]
+        for name in self._strings:
+            strings = np.array(self._table.strings(name) or [None], dtype=object)
+            valid = ~mask[name]
+            data[name][valid] = strings[values[name][valid]]
+
+        return ma.array(data, mask=mask).reshape(self.shape)
+
+    def columns(self):
+        """Return the flat values and mask of each field as read-only memory
+        maps, with the strings the codes of string fields refer to, or None
+        for other fields.
+        """
+        if not self.exists():
+            return {
+                name: (np.zeros((self.size,), dtype=dtype), np.ones((self.size,), dtype=bool), [] if name in self._strings else None)
+                for name, dtype in self._values_dtype()
+            }
+
+        values = np.load(self.path / 'values.npy', mmap_mode='r')
+        mask = np.load(self.path / 'mask.npy', mmap_mode='r')
+        columns = {}
+        for name in self.dtype.names:
+            if name in self._strings:
+                codes, strings = self.codes(name)
+                columns[name] = (codes.reshape(-1), mask[name], strings)
+            else:
+                columns[name] = (values[name], mask[name], None)
+        return columns
+
+    def codes(self, name):
+        """Return the codes of a string field as a read-only memory map, and
+        the strings they refer to.
+        """
+        values = np.load(self.path / 'values.npy', mmap_mode='r')
+        return values[name].reshape(self.shape), self._table.strings(name)
+
+
+class ResultCache:
+    """Content-addressed cache of captured values, keyed on a hash of the
+    fully rendered inputs of a point.  Unlike the result store, it does
+    not depend on the shape of the parameter space.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _entry(self, key):
+        return self.path / key[:2] / f'{key}.json'
+
+    def get(self, key):
+        try:
+            with open(self._entry(key), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, values):
+        path = self._entry(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile('w', dir=path.parent, delete=False) as f:
+            json.dump(values, f)
+        os.replace(f.name, path)
+
+
+class ArtifactStore:
+    """Content-addressed storage of files produced by points.  Each
+    distinct file content is stored once, compressed with gzip, no matter
+    how many points produce it.  A manifest per point maps file names to
+    content hashes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _object(self, key):
+        return self.path / 'objects' / key[:2] / f'{key}.gz'
+
+    def _manifest(self, index):
+        return self.path / 'index' / f'{index}.json'
+
+    def add(self, source):
+        """Store the contents of a file, and return its content hash."""
+        digest = hashlib.sha256()
+        with open(source, 'rb') as f:
+            for chunk in iter(partial(f.read, ARTIFACT_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        key = digest.hexdigest()
+
+        # Only new contents are compressed
+        path = self._object(key)
+        if path.exists():
+            return key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(source, 'rb') as f, NamedTemporaryFile(dir=path.parent, delete=False) as tmp:
+            with gzip.GzipFile(fileobj=tmp, mode='wb', mtime=0) as gz:
+                for chunk in iter(partial(f.read, ARTIFACT_CHUNK_SIZE), b''):
+                    gz.write(chunk)
+        os.replace(tmp.name, path)
+        return key
+
+    def put_manifest(self, index, manifest):
+        path = self._manifest(index)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile('w', dir=path.parent, delete=False) as f:
+            json.dump(manifest, f)
+        os.replace(f.name, path)
+
+    def drop_manifest(self, index):
+        self._manifest(index).unlink(missing_ok=True)
+
+    def clear_manifests(self):
+        """Drop the manifests of all points, whose flat indices no longer
+        refer to the same points if the grid changes.
+        """
+        shutil.rmtree(self.path / 'index', ignore_errors=True)
+
+    def manifest(self, index):
+        try:
+            with open(self._manifest(index), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def open(self, index, name):
+        """Open a stored file of a point for reading, in binary mode."""
+        manifest = self.manifest(index)
+        if name not in manifest:
+            raise KeyError(name)
+        return gzip.open(self._object(manifest[name]), 'rb')
+
+
+class StageCache:
+    """Outputs of memoized commands: their captured values and the files
+    they wrote to the work directory, keyed on a hash of the command and
+    the values it depends on.  Stored files are write-protected, since
+    they may be linked into work directories.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def lockpath(self, key):
+        return self.path / f'{key}.lock'
+
+    def get(self, key):
+        """Return the captured values of an entry, and the directory holding
+        its files, or None if there is no such entry.
+        """
+        entry = self.path / key
+        try:
+            with open(entry / 'values.json', 'r') as f:
+                return json.load(f), entry / 'files'
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, values, workpath, files):
+        # Entries are assembled under a temporary name, and renamed into
+        # place when complete
+        tmppath = Path(mkdtemp(dir=self.path, prefix='.'))
+        for relpath in files:
+            target = tmppath / 'files' / relpath
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copyfile(workpath / relpath, target)
+            target.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        with open(tmppath / 'values.json', 'w') as f:
+            json.dump(values, f)
+        try:
+            os.rename(tmppath, self.path / key)
+        except OSError:
+            shutil.rmtree(tmppath)
@@ -1,3 +1,7 @@
+from concurrent.futures import FIRST_COMPLETED, wait
+from itertools import islice
+
+
 def subclasses(cls, root=False):
     if root:
         yield cls
@@ -11,3 +15,33 @@ def find_subclass(cls, name, root=False, attr='__tag__'):
         if hasattr(sub, attr) and getattr(sub, attr) == name:
             return sub
     return None
+
+
+def update_digest(digest, *items):
+    for item in items:
+        if isinstance(item, str):
+            item = item.encode()
+        digest.update(len(item).to_bytes(8, 'little'))
+        digest.update(item)
+
+
+def file_identity(path):
+    stat = path.stat()
+    return f'{path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def dispatch(executor, func, arguments, window):
+    """Submit func(*args) to an executor for each tuple of arguments, with
+    at most *window* calls in flight, and yield the futures as they
+    complete.  Closing the generator cancels calls not yet started.
+    """
+    arguments = iter(arguments)
+    pending = {executor.submit(func, *args) for args in islice(arguments, window)}
+    try:
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            pending |= {executor.submit(func, *args) for args in islice(arguments, len(done))}
+            yield from done
+    finally:
+        for future in pending:
+            future.cancel()
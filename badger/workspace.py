@@ -0,0 +1,75 @@
+import os
+from pathlib import Path
+import shutil
+import stat
+from threading import Lock
+
+
+# From linux/fs.h
+FICLONE = 0x40049409
+
+
+def _reflink(source, target):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("reflinks are not supported on this platform")
+    with open(source, 'rb') as src, open(target, 'wb') as tgt:
+        fcntl.ioctl(tgt.fileno(), FICLONE, src.fileno())
+
+
+def provision(source, target, mode='copy'):
+    """Make the file *source* available at *target*, linking it if
+    possible, and falling back to copying it otherwise.
+    """
+    if mode == 'symlink':
+        os.symlink(Path(source).resolve(), target)
+        return
+    if mode == 'hardlink':
+        try:
+            os.link(source, target)
+            return
+        except OSError:
+            pass
+    elif mode == 'reflink':
+        try:
+            _reflink(source, target)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, target)
+
+
+def snapshot(path):
+    """Identify the files under a directory by size and modification time,
+    so that changes can be detected.
+    """
+    files = {}
+    for root, _, names in os.walk(path):
+        for name in names:
+            filepath = Path(root) / name
+            stat_result = filepath.stat()
+            files[filepath.relative_to(path)] = (stat_result.st_size, stat_result.st_mtime_ns)
+    return files
+
+
+class Staging:
+    """Read-only copies of input files, made once per run in the work
+    root, so that they can be linked into each work directory.  Staged
+    files are write-protected, since links share their contents.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._staged = {}
+        self._lock = Lock()
+
+    def stage(self, source):
+        source = Path(source).resolve()
+        with self._lock:
+            if source not in self._staged:
+                target = self.path / f'{len(self._staged)}-{source.name}'
+                shutil.copyfile(source, target)
+                target.chmod(stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+                self._staged[source] = target
+            return self._staged[source]
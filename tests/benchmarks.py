@@ -0,0 +1,173 @@
+"""Benchmarks for the overhead of Badger itself.
+
+The synthetic cases run trivial commands, so that the cost of rendering,
+capturing and committing dominates.  Run with
+
+    python tests/benchmarks.py [--quick] [SUITE ...]
+
+This file is deliberately not named test_*.py, so pytest doesn't collect it.
+"""
+
+import argparse
+from multiprocessing import Process
+from pathlib import Path
+import resource
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+
+import numpy as np
+import treelog as log
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from badger import Case, ResultCollector
+
+
+def write_case(path, npoints=10, ntemplates=0, output=0, ncaptures=1):
+    """Write a synthetic case with *npoints* points and *ntemplates*
+    templates, whose command prints *output* bytes of filler and a line
+    matched by each of *ncaptures* patterns.
+    """
+    lines = ['parameters:', f'  alpha: {list(range(npoints))}']
+
+    if ntemplates:
+        lines.append('templates:')
+        for i in range(ntemplates):
+            (path / f'template{i}.txt').write_text(f'alpha = ${{alpha}}\nindex = {i}\n' * 10)
+            lines.append(f'  - template{i}.txt')
+
+    if output:
+        (path / 'filler.txt').write_text(('x' * 79 + '\n') * (output // 80))
+        lines.extend(['prefiles:', '  - filler.txt'])
+        command = 'cat filler.txt; echo ' + ' '.join(f'v{i}=${{alpha}}' for i in range(ncaptures))
+    else:
+        command = 'echo ' + ' '.join(f'v{i}=${{alpha}}' for i in range(ncaptures))
+
+    lines.extend(['script:', f'  - command: {command}', '    capture:'])
+    lines.extend(f'      - v{i}=(?P<v{i}>\\d+)' for i in range(ncaptures))
+    lines.append('types:')
+    lines.extend(f'  v{i}: int' for i in range(ncaptures))
+    lines.extend(['settings:', '  cache: off'])
+
+    (path / 'badger.yaml').write_text('\n'.join(lines) + '\n')
+
+
+def measure(jobs=1, npoints=10, **kwargs):
+    """Run a synthetic case, and return its throughput in points per
+    second and the peak of memory allocated by Python during the run.
+    Memory is traced in a separate run, since tracing slows everything
+    down.
+    """
+    with TemporaryDirectory() as tmp:
+        path = Path(tmp)
+        write_case(path, npoints=npoints, **kwargs)
+
+        case = Case(path)
+        start = perf_counter()
+        case.run(jobs=jobs)
+        duration = perf_counter() - start
+        assert case.status()['done'] == npoints
+
+        case.clear_cache()
+        case = Case(path)
+        tracemalloc.start()
+        case.run(jobs=jobs)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return npoints / duration, peak
+
+
+def scaling(name, values, quick, **fixed):
+    if quick:
+        values = values[:2]
+    for value in values:
+        throughput, peak = measure(**{**fixed, name: value})
+        print(f'{name:>12} {value:>9}  {throughput:>10.1f} points/s  {peak / 2**20:>8.2f} MiB')
+
+
+def grid(quick):
+    scaling('npoints', [10, 100, 1000, 5000], quick)
+
+
+def templates(quick):
+    scaling('ntemplates', [0, 4, 16, 64], quick, npoints=100)
+
+
+def output(quick):
+    scaling('output', [0, 1 << 14, 1 << 18, 1 << 22], quick, npoints=50)
+
+
+def captures(quick):
+    scaling('ncaptures', [1, 8, 32, 128], quick, npoints=100)
+
+
+def jobs(quick):
+    scaling('jobs', [1, 2, 4, 8], quick, npoints=200)
+
+
+def _commit(path, indices):
+    with log.set(log.NullLog()):
+        case = Case(path)
+        for index in indices:
+            collector = ResultCollector(case._types)
+            collector.collect('alpha', index)
+            collector.collect('v0', index)
+            case.commit_result(index, collector)
+
+
+def stress(quick):
+    """Commit disjoint sets of points from several processes into the same
+    storage, and check that nothing is lost.
+    """
+    npoints = 500 if quick else 5000
+    for nprocs in ([1, 4] if quick else [1, 2, 4, 8, 16]):
+        with TemporaryDirectory() as tmp:
+            path = Path(tmp)
+            write_case(path, npoints=npoints)
+
+            procs = [Process(target=_commit, args=(path, range(i, npoints, nprocs))) for i in range(nprocs)]
+            start = perf_counter()
+            for proc in procs:
+                proc.start()
+            for proc in procs:
+                proc.join()
+            duration = perf_counter() - start
+
+            data = Case(path).result_array()
+            assert not data['v0'].mask.any()
+            np.testing.assert_array_equal(data['v0'], np.arange(npoints))
+            print(f'{"processes":>12} {nprocs:>9}  {npoints / duration:>10.1f} commits/s')
+
+
+SUITES = {
+    'grid': grid,
+    'templates': templates,
+    'output': output,
+    'captures': captures,
+    'jobs': jobs,
+    'stress': stress,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true', help='run smaller variants only')
+    parser.add_argument('suites', nargs='*', metavar='SUITE', help=f'one of {", ".join(SUITES)}')
+    args = parser.parse_args()
+    for name in args.suites:
+        if name not in SUITES:
+            parser.error(f'unknown suite: {name}')
+
+    with log.set(log.NullLog()):
+        for name in args.suites or SUITES:
+            print(f'== {name}')
+            SUITES[name](args.quick)
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    print(f'peak RSS: {rusage.ru_maxrss / 1024:.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
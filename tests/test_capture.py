@@ -0,0 +1,50 @@
+from badger import Capture, CaptureEngine, ResultCollector
+
+
+TYPES = {'it': int, 'res': float, 'name': str, 'first': int, 'dup': str}
+
+
+def collect_separately(captures, text):
+    collector = ResultCollector(TYPES)
+    for capture in captures:
+        for match in capture.matches(text):
+            for name, value in match.groupdict().items():
+                collector.collect(name, value)
+    return collector
+
+
+def collect_combined(captures, *chunks):
+    collector = ResultCollector(TYPES)
+    scan = CaptureEngine(captures).scan()
+    for chunk in chunks:
+        scan.feed(chunk)
+    scan.finish(collector)
+    return collector
+
+
+def test_engine():
+    lines = [f'iteration {i} residual {1/(i+1)}' for i in range(500)]
+    lines.insert(100, 'name: alpha')
+    lines.insert(300, 'name: bravo dup dup')
+    text = '\n'.join(lines)
+
+    captures = [
+        Capture(r'iteration (?P<it>\d+) residual (?P<res>\S+)'),
+        Capture(r'iteration (?P<first>\d+)', mode='first'),
+        Capture(r'name: (?P<name>\w+)', mode='all'),
+        Capture(r'(?P<dup>\w+) (?P=dup)'),
+    ]
+    expected = collect_separately(captures, text)
+    assert expected == {'it': 499, 'res': 1/500, 'first': 0, 'name': 'bravo', 'dup': 'dup'}
+    assert collect_combined(captures, text) == expected
+    assert collect_combined(captures, *(line + '\n' for line in lines)) == expected
+
+
+def test_engine_fallback():
+    # Numbered backreferences can't be combined
+    captures = [
+        Capture(r'(\w)\1(?P<name>\w+)'),
+        Capture(r'(?P<it>\d+)', mode='first'),
+    ]
+    text = 'abc 12 aabc 34'
+    assert collect_combined(captures, text) == collect_separately(captures, text) == {'name': 'bc', 'it': 12}
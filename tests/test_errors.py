@@ -3,7 +3,7 @@ from pathlib import Path
 from pytest import raises, mark
 from strictyaml import YAMLValidationError
 
-from badger import Case
+from badger import BaseCommand, Case, Command, PythonCommand
 
 
 DATADIR = Path(__file__).parent / 'data'
@@ -18,3 +18,18 @@ ERRORFILES = [
 def test_raises(filename):
     with raises(YAMLValidationError):
         Case(filename)
+
+
+@mark.parametrize('options', [{'retries': -1}, {'timeout': 0}, {'timeout': -1.5}])
+def test_command_options(options):
+    with raises(ValueError):
+        Command('true', **options)
+
+
+def test_function_options():
+    with raises(ValueError):
+        PythonCommand('model', retries=0)
+    with raises(ValueError):
+        PythonCommand('model:run', retries=-1)
+    with raises(ValueError):
+        BaseCommand.load({'function': 'model:run', 'retries': -1})
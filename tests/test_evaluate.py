@@ -0,0 +1,45 @@
+from itertools import product
+
+import numpy as np
+from simpleeval import SimpleEval
+
+from badger.evaluate import evaluate_grid, item
+
+
+def test_grid():
+    parameters = {
+        'alpha': [1, 2, 3],
+        'bravo': [0.5, 1.5],
+        'charlie': ['x', 'y'],
+        'delta': [3, 4.5],
+    }
+    evaluables = {
+        'lin': '2 * alpha - 1',
+        'div': 'alpha / 2 + bravo',
+        'floordiv': 'delta // 2',
+        'string': 'charlie * alpha + "z"',
+        'power': 'bravo ** alpha',
+        'const': '14',
+        'cond': 'alpha if alpha > 1 else bravo',
+        'call': 'str(alpha) + charlie',
+        'dep': 'lin * div - floordiv',
+    }
+    shape = (3, 2, 2, 2)
+    grid = evaluate_grid(parameters, evaluables, shape)
+
+    # Results only extend along the axes they depend on
+    assert grid['lin'].shape == (3, 1, 1, 1)
+    assert grid['div'].shape == (3, 2, 1, 1)
+    assert grid['const'].shape == (1, 1, 1, 1)
+    assert grid['cond'].shape == (3, 2, 1, 1)
+    assert grid['call'].shape == shape
+
+    for index, values in enumerate(product(*parameters.values())):
+        evaluator = SimpleEval()
+        evaluator.names.update(zip(parameters, values))
+        index = np.unravel_index(index, shape)
+        for name, code in evaluables.items():
+            expected = evaluator.names[name] = evaluator.eval(code)
+            value = item(np.broadcast_to(grid[name], shape)[index])
+            assert value == expected
+            assert type(value) == type(expected)
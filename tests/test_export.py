@@ -0,0 +1,99 @@
+import csv
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from badger import Case
+from badger.export import export
+
+
+DATADIR = Path(__file__).parent / 'data'
+
+
+@pytest.fixture
+def case(tmp_path):
+    (tmp_path / 'badger.yaml').write_text("""
+parameters:
+  alpha: [1, 2, 3]
+  bravo: ['a', 'b']
+evaluate:
+  charlie: 2 * alpha
+script:
+  - command: test ${alpha} != 3 && echo a=${alpha} b=${bravo}
+    capture: a=(?P<a>\\S+) b=(?P<b>\\S+)
+types:
+  a: int
+  b: str
+""")
+    case = Case(tmp_path)
+    case.run()
+    return case
+
+
+def test_npz(case, tmp_path):
+    export(case, tmp_path / 'out.npz')
+    with np.load(tmp_path / 'out.npz', allow_pickle=False) as data:
+        assert data['axes'].tolist() == ['alpha', 'bravo']
+        assert data['coords/alpha'].tolist() == [1, 2, 3]
+        assert data['coords/bravo'].tolist() == ['a', 'b']
+        assert data['charlie'].tolist() == [[2, 2], [4, 4], [0, 0]]
+        assert data['a'].tolist() == [[1, 1], [2, 2], [0, 0]]
+        assert data['b'].tolist() == [['a', 'b'], ['a', 'b'], ['', '']]
+        assert data['valid/a'].tolist() == [[True, True], [True, True], [False, False]]
+        assert 'alpha' not in data
+
+
+def test_csv(case, tmp_path):
+    export(case, tmp_path / 'out.csv')
+    with open(tmp_path / 'out.csv', newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['index', 'alpha', 'bravo', 'a', 'b', 'charlie']
+    assert rows[1] == ['0', '1', 'a', '1', 'a', '2']
+    assert rows[6] == ['5', '3', 'b', '', '', '']
+
+
+def test_hdf5(case, tmp_path):
+    h5py = pytest.importorskip('h5py')
+    export(case, tmp_path / 'out.h5')
+    with h5py.File(tmp_path / 'out.h5', 'r') as f:
+        assert f['coords/bravo'].asstr()[:].tolist() == ['a', 'b']
+        assert f['a'][:, 0].tolist() == [1, 2, 0]
+        assert f['b'].asstr()[1, 1] == 'b'
+        assert f['valid/b'][:].sum() == 4
+        assert f['a'].dims[0][0].name == '/coords/alpha'
+
+
+def test_parquet(case, tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    export(case, tmp_path / 'out.parquet')
+    table = pq.read_table(tmp_path / 'out.parquet', columns=['index', 'a'])
+    assert table['index'].to_pylist() == [0, 1, 2, 3, 4, 5]
+    assert table['a'].to_pylist() == [1, 1, 2, 2, None, None]
+
+
+def test_chunks(case, tmp_path, monkeypatch):
+    monkeypatch.setattr('badger.export.EXPORT_CHUNK_SIZE', 4)
+    export(case, tmp_path / 'out.npz')
+    with np.load(tmp_path / 'out.npz', allow_pickle=False) as data:
+        assert data['b'].tolist() == [['a', 'b'], ['a', 'b'], ['', '']]
+    export(case, tmp_path / 'out.csv')
+    with open(tmp_path / 'out.csv', newline='') as f:
+        rows = list(csv.reader(f))
+    assert [row[4] for row in rows[1:]] == ['a', 'b', 'a', 'b', '', '']
+
+
+def test_empty(tmp_path):
+    (tmp_path / 'badger.yaml').write_text("""
+parameters:
+  alpha: [1, 2]
+script:
+  - command: echo a=${alpha}
+    capture: a=(?P<a>\\S+)
+types:
+  a: str
+""")
+    export(Case(tmp_path), tmp_path / 'out.npz')
+    with np.load(tmp_path / 'out.npz', allow_pickle=False) as data:
+        assert data['a'].tolist() == ['', '']
+        assert not data['valid/a'].any()
@@ -1,6 +1,8 @@
+from itertools import product
 from pathlib import Path
 
 import numpy as np
+import pytest
 
 from badger import Case
 
@@ -75,3 +77,54 @@ def test_parse():
     assert case._commands[5]._capture[2]._mode == 'last'
 
     assert case._logdir == 'loop-de-loop'
+
+
+def test_parameter_space():
+    case = Case(DATADIR / 'valid' / 'diverse.yaml')
+    space = case.parameters()
+
+    assert space.shape == case.shape == (2, 2, 2, 5, 5, 3)
+    assert len(space) == 600
+
+    expected = [dict(zip(case._parameters, values)) for values in product(*case._parameters.values())]
+    assert list(space) == expected
+    assert space[0] == expected[0]
+    assert space[-1] == expected[-1]
+    assert list(space[10:20]) == expected[10:20]
+    assert list(space[10:20].items()) == list(enumerate(expected))[10:20]
+
+    chunks = list(space.chunks(64))
+    assert [len(chunk) for chunk in chunks] == [64] * 9 + [24]
+    assert [ctx for chunk in chunks for ctx in chunk] == expected
+
+    shards = [space.shard(i, 7) for i in range(7)]
+    assert [index for shard in shards for index in shard.indices] == list(range(600))
+
+
+def test_cached_casedata(tmp_path, monkeypatch):
+    text = (DATADIR / 'run' / 'echo.yaml').read_text()
+    (tmp_path / 'badger.yaml').write_text(text)
+    case = Case(tmp_path)
+
+    # Unchanged case files are not validated again
+    import badger.case
+    import badger.schema
+    def fail(*args, **kwargs):
+        raise AssertionError('validated')
+    monkeypatch.setattr(badger.schema, 'load_and_validate', fail)
+    cached = Case(tmp_path)
+    assert cached._types == case._types
+    assert cached._evaluables == case._evaluables
+    assert [c._command for c in cached._commands] == [c._command for c in case._commands]
+
+    (tmp_path / 'badger.yaml').write_text(text.replace('[1, 2, 3]', '[1, 2]'))
+    with pytest.raises(AssertionError):
+        Case(tmp_path)
+
+    # Nor are they when the schema changes
+    (tmp_path / 'badger.yaml').write_text(text)
+    schema = tmp_path / 'schema.py'
+    schema.write_text(badger.case.SCHEMA_PATH.read_text() + '\n# changed\n')
+    monkeypatch.setattr(badger.case, 'SCHEMA_PATH', schema)
+    with pytest.raises(AssertionError):
+        Case(tmp_path)
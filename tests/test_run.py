@@ -1,8 +1,12 @@
 from pathlib import Path
+import sys
+from time import perf_counter
 
 import numpy as np
+import pytest
 
-from badger import Case
+from badger import Case, Command
+from badger.backend import LocalBackend
 
 
 DATADIR = Path(__file__).parent / 'data'
@@ -48,3 +52,667 @@ def test_cat():
     np.testing.assert_array_equal(data['bravo'], [['a', 'b', 'c'], ['a', 'b', 'c'], ['a', 'b', 'c']])
     np.testing.assert_array_equal(data['c'], [[1, 1, 1], [3, 3, 3], [5, 5, 5]])
     np.testing.assert_array_equal(data['charlie'], [[1, 1, 1], [3, 3, 3], [5, 5, 5]])
+
+
+def test_echo_parallel():
+    case = Case(DATADIR / 'run' / 'echo.yaml')
+    case.clear_cache()
+    case.run(jobs=4)
+
+    data = case.result_array()
+    for name in data.dtype.names:
+        assert not data[name].mask.any()
+    np.testing.assert_array_equal(data['a'], [[1, 1, 1], [2, 2, 2], [3, 3, 3]])
+    np.testing.assert_array_equal(data['b'], [['a', 'b', 'c'], ['a', 'b', 'c'], ['a', 'b', 'c']])
+    np.testing.assert_array_equal(data['c'], [[1, 1, 1], [3, 3, 3], [5, 5, 5]])
+
+
+def test_resume():
+    case = Case(DATADIR / 'run' / 'echo.yaml')
+    case.clear_cache()
+    case.run()
+
+    # Pretend that two of the points never finished
+    status = np.load(case.storagepath / 'results' / 'status.npy')
+    status[[1, 5]] = 0
+    np.save(case.storagepath / 'results' / 'status.npy', status)
+
+    dispatched = []
+    prepare = case.prepare
+    def wrapped(index, namespace, *args):
+        dispatched.append(index)
+        return prepare(index, namespace, *args)
+    case.prepare = wrapped
+
+    case.run(resume=True)
+    assert sorted(dispatched) == [1, 5]
+
+    data = case.result_array()
+    np.testing.assert_array_equal(data['a'], [[1, 1, 1], [2, 2, 2], [3, 3, 3]])
+    np.testing.assert_array_equal(case._store.status_array(), np.ones((3, 3)))
+
+
+def test_cache(tmp_path, monkeypatch):
+    ncalls = 0
+    run = Command.run
+    def counted(self, *args, **kwargs):
+        nonlocal ncalls
+        ncalls += 1
+        return run(self, *args, **kwargs)
+    monkeypatch.setattr(Command, 'run', counted)
+
+    text = (DATADIR / 'run' / 'echo.yaml').read_text()
+    (tmp_path / 'badger.yaml').write_text(text)
+    case = Case(tmp_path)
+    case.run()
+    assert ncalls == 9
+
+    # Extending a parameter only runs the new points
+    (tmp_path / 'badger.yaml').write_text(text.replace('alpha: [1, 2, 3]', 'alpha: [3, 4, 1, 2]'))
+    case = Case(tmp_path)
+    case.run()
+    assert ncalls == 12
+
+    data = case.result_array()
+    np.testing.assert_array_equal(data['a'], [[3, 3, 3], [4, 4, 4], [1, 1, 1], [2, 2, 2]])
+    np.testing.assert_array_equal(data['c'], [[5, 5, 5], [7, 7, 7], [1, 1, 1], [3, 3, 3]])
+
+
+def test_cache_script(tmp_path):
+    # Changing a script passed to an interpreter invalidates the cache
+    script = tmp_path / 'solve.sh'
+    script.write_text('echo v=1\n')
+    (tmp_path / 'badger.yaml').write_text(f"""
+parameters:
+  alpha: [1, 2]
+script:
+  - command: sh {script} ${{alpha}}
+    capture: v=(?P<v>\\d+)
+types:
+  v: int
+""")
+    case = Case(tmp_path)
+    case.run()
+    np.testing.assert_array_equal(case.result_array()['v'], [1, 1])
+
+    script.write_text('echo v=2\n')
+    case.run()
+    np.testing.assert_array_equal(case.result_array()['v'], [2, 2])
+
+
+def test_stream():
+    case = Case(DATADIR / 'run' / 'stream.yaml')
+    case.clear_cache()
+    case.run()
+
+    data = case.result_array()
+    np.testing.assert_array_equal(data['first'], np.zeros((3, 3), dtype=int))
+    np.testing.assert_array_equal(data['a'], [[1, 1, 1], [2, 2, 2], [3, 3, 3]])
+    np.testing.assert_array_equal(data['b'], [['a', 'b', 'c'], ['a', 'b', 'c'], ['a', 'b', 'c']])
+    np.testing.assert_array_equal(data['c'], [[1, 1, 1], [3, 3, 3], [5, 5, 5]])
+
+    stdout = (case.storagepath / '2-b' / 'loop.stdout').read_text()
+    assert stdout.splitlines() == ['a=0 b=x c=0', 'a=1 b=x c=1', 'a=2 b=x c=2', 'a=2 b=b c=3']
+
+
+def test_prefile_link(tmp_path):
+    (tmp_path / 'data.txt').write_text('x=5\n')
+    (tmp_path / 'badger.yaml').write_text(f"""
+parameters:
+  alpha: [1, 2]
+prefiles:
+  - data.txt
+script:
+  - command: cat data.txt; echo links=$(stat -c %h data.txt); echo dir=$(pwd)
+    capture:
+      - x=(?P<x>\\S+)
+      - links=(?P<links>\\S+)
+      - dir=(?P<dir>\\S+)
+types:
+  x: int
+  links: int
+  dir: str
+settings:
+  workdir: {tmp_path / 'scratch'}
+  prefile-link: hardlink
+  cache: off
+""")
+    case = Case(tmp_path)
+    case.run()
+
+    data = case.result_array()
+    np.testing.assert_array_equal(data['x'], [5, 5])
+
+    # The prefile is linked to a staged copy in the work root
+    assert (data['links'] >= 2).all()
+    for path in data['dir']:
+        assert Path(path).parent == tmp_path / 'scratch'
+
+
+@pytest.mark.parametrize('mode', ['hardlink', 'symlink'])
+def test_prefile_link_templated(tmp_path, mode):
+    # Prefiles whose names vary between points are staged too, so writing
+    # to them never modifies the originals
+    for alpha in (1, 2):
+        (tmp_path / f'in-{alpha}.txt').write_text(f'x={alpha}\n')
+    (tmp_path / 'badger.yaml').write_text(f"""
+parameters:
+  alpha: [1, 2]
+prefiles:
+  - in-${{alpha}}.txt
+script:
+  - command: cat in-${{alpha}}.txt; echo CLOBBERED >> in-${{alpha}}.txt; true
+    capture: x=(?P<x>\\S+)
+types:
+  x: int
+settings:
+  prefile-link: {mode}
+  cache: off
+""")
+    case = Case(tmp_path)
+    case.run()
+
+    np.testing.assert_array_equal(case.result_array()['x'], [1, 2])
+    for alpha in (1, 2):
+        assert (tmp_path / f'in-{alpha}.txt').read_text() == f'x={alpha}\n'
+
+
+def test_profile(tmp_path):
+    text = (DATADIR / 'run' / 'echo.yaml').read_text()
+    (tmp_path / 'badger.yaml').write_text(text)
+    case = Case(tmp_path)
+    case.run(jobs=2)
+
+    summary = case.profile(slowest=3)
+    for phase in ('evaluate', 'fingerprint', 'echo:spawn', 'echo:run', 'echo:capture', 'lock', 'commit'):
+        assert summary['phases'][phase]['count'] == 9
+    assert len(summary['slowest']) == 3
+    assert summary['slowest'][0]['total'] >= summary['slowest'][-1]['total']
+    assert 0 < summary['overhead'] < 1
+
+    # A new run replaces the trace, resuming appends to it
+    case.run()
+    assert case.profile()['phases']['evaluate']['count'] == 9
+    assert 'echo:run' not in case.profile()['phases']
+    case.run(resume=True)
+    assert case.profile()['phases']['evaluate']['count'] == 9
+
+
+def test_plan(tmp_path):
+    (tmp_path / 'badger.yaml').write_text("""
+parameters:
+  size: [1, 3, 2, 4]
+script:
+  - command: echo ${size}
+    capture-walltime: on
+settings:
+  cost: size ** 2
+""")
+    case = Case(tmp_path)
+
+    # Before any run, the cost expression only gives relative costs
+    plan = case.plan(jobs=2)
+    assert not plan['seconds']
+    assert plan['points'] == 4
+    assert plan['total'] == 30
+    assert plan['makespan'] == 16
+    assert plan['makespan-in-order'] == 21
+
+    dispatched = []
+    prepare = case.prepare
+    def wrapped(index, namespace, *args):
+        dispatched.append(index)
+        return prepare(index, namespace, *args)
+    case.prepare = wrapped
+    case.run()
+    assert dispatched == [3, 1, 2, 0]
+
+    # Afterwards, the recorded walltimes are used
+    walltimes = case.result_array()['echo']
+    plan = case.plan(jobs=1)
+    assert plan['seconds']
+    assert plan['total'] == pytest.approx(walltimes.sum())
+    assert plan['makespan'] == pytest.approx(walltimes.sum())
+
+    # Points without walltimes are estimated from the others
+    case.mark_pending([0])
+    costs, seconds = case.predicted_costs()
+    assert seconds
+    assert costs[0] == pytest.approx(np.median(walltimes[1:] / np.array([9, 4, 16])))
+
+
+def test_plan_uniform(tmp_path):
+    (tmp_path / 'badger.yaml').write_text((DATADIR / 'run' / 'echo.yaml').read_text())
+    case = Case(tmp_path)
+
+    class Recorder(LocalBackend):
+        def run(self, case, parameters):
+            self.indices = parameters.indices
+            return super().run(case, parameters)
+
+    # Without differences in cost, the lazy grid order is kept
+    backend = Recorder()
+    case.run(backend=backend)
+    assert isinstance(backend.indices, range)
+    assert case.plan()['points'] == 9
+
+
+def test_resources(tmp_path):
+    (tmp_path / 'badger.yaml').write_text(f"""
+parameters:
+  size: [10, 100]
+script:
+  - command: {sys.executable} -c "x = bytearray(${{size}} * 2 ** 20); print(len(x))"
+    name: alloc
+    capture-resources: on
+  - command: echo done
+    capture-resources: off
+""")
+    case = Case(tmp_path)
+    case.run()
+
+    data = case.result_array()
+    assert data['alloc-maxrss'].dtype == int
+    assert data['alloc-utime'].dtype == float
+    assert data['alloc-stime'].dtype == float
+    assert data['alloc-nvcsw'].dtype == int
+    assert data['alloc-nivcsw'].dtype == int
+    assert 'echo-maxrss' not in data.dtype.names
+
+    # The shell's usage includes that of the commands it runs.  Peak RSS
+    # may also include pages shared with the parent before exec, so only
+    # lower bounds are reliable.
+    assert data['alloc-maxrss'][0] >= 10 * 2 ** 20
+    assert data['alloc-maxrss'][1] >= 100 * 2 ** 20
+    assert (data['alloc-utime'] + data['alloc-stime'] > 0).all()
+
+
+@pytest.mark.parametrize('stream', ['off', 'on'])
+def test_retries(tmp_path, stream):
+    (tmp_path / 'badger.yaml').write_text(f"""
+parameters:
+  alpha: [1, 2, 3]
+script:
+  - command: >-
+      if [ ${{alpha}} = 3 ]; then sleep 60; fi;
+      if [ ${{alpha}} = 2 ] && [ ! -e flag ]; then touch flag; echo stale=99; exit 1; fi;
+      echo a=${{alpha}}
+    name: flaky
+    capture:
+      - a=(?P<a>\\S+)
+      - stale=(?P<stale>\\S+)
+    stream: {stream}
+    timeout: 1
+    retries: 1
+    retry-backoff: 0.01
+types:
+  a: int
+  stale: int
+settings:
+  logdir: ${{alpha}}
+""")
+    case = Case(tmp_path)
+    start = perf_counter()
+    case.run()
+
+    # The sleeping child is killed along with the shell
+    assert perf_counter() - start < 30
+
+    # Nothing captured by failed attempts is kept
+    data = case.result_array()
+    assert data['a'].tolist() == [1, 2, None]
+    assert data['stale'].tolist() == [None, None, None]
+    assert case.outcome_array().tolist() == ['ok', 'retried-1', 'timed-out']
+    assert case.status()['timed-out'] == 1
+    assert case.status()['retried'] == 2
+
+    # Logs of failed attempts are kept
+    assert (case.storagepath / '2' / 'flaky.1.stdout').exists()
+    assert (case.storagepath / '3' / 'flaky.1.stdout').exists()
+    assert (case.storagepath / '3' / 'flaky.stdout').exists()
+
+
+def test_postfiles(tmp_path):
+    (tmp_path / 'badger.yaml').write_text("""
+parameters:
+  alpha: [1, 2, 3]
+  bravo: [1, 2]
+script:
+  - command: echo mesh > mesh.vtk; echo alpha=${alpha} > out.txt
+postfiles:
+  - mesh.vtk
+  - source: out.txt
+    target: out-${alpha}.txt
+  - missing.txt
+""")
+    case = Case(tmp_path)
+    case.run()
+
+    assert case.postfiles(0) == ['mesh.vtk', 'out-1.txt']
+    with case.open_postfile(5, 'out-3.txt') as f:
+        assert f.read() == b'alpha=3\n'
+    with case.open_postfile(4, 'mesh.vtk') as f:
+        assert f.read() == b'mesh\n'
+
+    # Identical files are stored once
+    objects = list((case.storagepath / 'artifacts' / 'objects').glob('*/*.gz'))
+    assert len(objects) == 4
+
+    # Cached points reuse stored files
+    (case.storagepath / 'artifacts').joinpath('index').rename(tmp_path / 'old')
+    case.run()
+    assert case.postfiles(5) == ['mesh.vtk', 'out-3.txt']
+
+
+def test_postfiles_grid_change(tmp_path):
+    text = """
+parameters:
+  alpha: [1, 2, 3]
+script:
+  - command: echo alpha=${alpha} > out.txt; [ ${alpha} != 5 ]
+postfiles:
+  - out.txt
+"""
+    (tmp_path / 'badger.yaml').write_text(text)
+    Case(tmp_path).run()
+
+    # Files stored for the old grid aren't attributed to the new points
+    (tmp_path / 'badger.yaml').write_text(text.replace('[1, 2, 3]', '[5, 1, 2, 3]'))
+    case = Case(tmp_path)
+    case.run()
+    assert case.postfiles(0) == []
+    with pytest.raises(KeyError):
+        case.open_postfile(0, 'out.txt')
+    with case.open_postfile(1, 'out.txt') as f:
+        assert f.read() == b'alpha=1\n'
+
+    # Failed points have no stored files
+    case.mark_failed(1)
+    assert case.postfiles(1) == []
+
+
+def test_string_codes(tmp_path):
+    text = (DATADIR / 'run' / 'echo.yaml').read_text()
+    (tmp_path / 'badger.yaml').write_text(text)
+    case = Case(tmp_path)
+    case.run(jobs=3)
+
+    # Nothing in the store needs pickling
+    values = np.load(case.storagepath / 'results' / 'values.npy', allow_pickle=False)
+    assert values.dtype['b'] == values.dtype['bravo'] == np.int32
+
+    # String parameters are encoded by their position along their axis
+    codes, strings = case._store.codes('bravo')
+    assert strings == ['a', 'b', 'c']
+    np.testing.assert_array_equal(codes, [[0, 1, 2]] * 3)
+
+    # Captured strings are interned
+    codes, strings = case._store.codes('b')
+    assert sorted(strings) == ['a', 'b', 'c']
+    assert [strings[code] for code in codes[0]] == ['a', 'b', 'c']
+
+    data = case.result_array()
+    assert data['b'].tolist() == [['a', 'b', 'c']] * 3
+
+
+def test_memoized(tmp_path):
+    (tmp_path / 'mesh.sh').write_text('echo mesh-${elements} > mesh.txt\necho ${elements} >> ' + f'{tmp_path}/partition.log\n')
+    (tmp_path / 'badger.yaml').write_text(f"""
+parameters:
+  elements: [4, 8, 16]
+  degree: [1, 2, 3]
+  timestep: [0.1, 0.2, 0.3]
+templates:
+  - mesh.sh
+script:
+  - command: echo ${{elements}} >> {tmp_path}/mesh.log; echo cells=${{elements}}
+    name: mesh
+    capture: cells=(?P<cells>\\d+)
+    depends: [elements]
+  - command: sh mesh.sh
+    name: partition
+    depends: auto
+  - command: cat mesh.txt; echo degree=${{degree}}
+    name: solve
+    capture:
+      - mesh-(?P<mesh>\\d+)
+      - degree=(?P<deg>\\d+)
+types:
+  cells: int
+  mesh: int
+  deg: int
+settings:
+  cache: off
+""")
+    case = Case(tmp_path)
+    assert case._commands[1].depends == {'elements'}
+    case.run(jobs=4)
+
+    # Each memoized command runs once per number of elements
+    assert sorted((tmp_path / 'mesh.log').read_text().split()) == ['16', '4', '8']
+    assert sorted((tmp_path / 'partition.log').read_text().split()) == ['16', '4', '8']
+
+    # Captured values and output files are reused by the other points
+    data = case.result_array()
+    assert not data['mesh'].mask.any()
+    np.testing.assert_array_equal(data['cells'], data['elements'])
+    np.testing.assert_array_equal(data['mesh'], data['elements'])
+    np.testing.assert_array_equal(data['deg'], data['degree'])
+
+
+def test_memoized_upstream(tmp_path):
+    (tmp_path / 'badger.yaml').write_text("""
+parameters:
+  degree: [1, 2, 3]
+script:
+  - command: echo ${degree} > input.dat
+    name: gen
+  - command: cat input.dat
+    name: solve
+    depends: auto
+    capture: (?P<out>\\d+)
+types:
+  out: int
+settings:
+  cache: off
+""")
+    case = Case(tmp_path)
+    assert case._commands[1].depends == {'degree'}
+    case.run()
+    np.testing.assert_array_equal(case.result_array()['out'], [1, 2, 3])
+
+
+def test_memoized_inputs(tmp_path):
+    (tmp_path / 'mesh.sh').write_text('echo v1-${elements} > mesh.txt\n')
+    (tmp_path / 'badger.yaml').write_text("""
+parameters:
+  elements: [4, 8]
+templates:
+  - mesh.sh
+script:
+  - command: sh mesh.sh
+    name: mesh
+    depends: [elements]
+  - command: cat mesh.txt
+    name: solve
+    capture: (?P<mesh>v\\d+)
+types:
+  mesh: str
+settings:
+  cache: off
+""")
+    Case(tmp_path).run()
+
+    # Editing a template reruns the commands that may read it
+    (tmp_path / 'mesh.sh').write_text('echo v2-${elements} > mesh.txt\n')
+    case = Case(tmp_path)
+    case.run()
+    assert case.result_array()['mesh'].tolist() == ['v2', 'v2']
+
+
+def test_function(tmp_path):
+    (tmp_path / 'model.py').write_text("""
+calls = []
+
+def model(alpha, beta):
+    calls.append((alpha, beta))
+    return {'total': alpha + beta, 'label': f'{alpha}-{beta}'}
+
+def square(alpha, **context):
+    return {'square': alpha ** 2}
+
+def broken(alpha):
+    raise RuntimeError('nope')
+
+def undeclared(alpha):
+    return {'unknown': alpha}
+""")
+    (tmp_path / 'badger.yaml').write_text("""
+parameters:
+  alpha: [1, 2, 3]
+  beta: [10, 20]
+evaluate:
+  gamma: alpha * 2
+script:
+  - function: model:model
+    capture-walltime: on
+  - function: model:square
+    depends: auto
+types:
+  total: int
+  label: str
+  square: float
+settings:
+  logdir: ${alpha}-${beta}
+""")
+    case = Case(tmp_path)
+    assert case._commands[1].depends == {'alpha', 'beta', 'gamma'}
+    case.run(jobs=2)
+
+    data = case.result_array()
+    np.testing.assert_array_equal(data['total'], [[11, 21], [12, 22], [13, 23]])
+    np.testing.assert_array_equal(data['label'], [['1-10', '1-20'], ['2-10', '2-20'], ['3-10', '3-20']])
+    np.testing.assert_array_equal(data['square'], [[1, 1], [4, 4], [9, 9]])
+    assert (data['model'] >= 0).all()
+
+    model = sys.modules[case._commands[0].resolve().__module__]
+    assert sorted(model.calls) == [(a, b) for a in (1, 2, 3) for b in (10, 20)]
+    assert 'model:run' in case.profile()['phases']
+
+    # Cached results are reused without calling the function again
+    model.calls.clear()
+    case.run()
+    assert model.calls == []
+
+    for function in ('broken', 'undeclared'):
+        (tmp_path / 'badger.yaml').write_text(f"""
+parameters:
+  alpha: [1, 2]
+script:
+  - function: model:{function}
+    retries: 1
+    retry-backoff: 0.01
+settings:
+  logdir: ${{alpha}}
+""")
+        case = Case(tmp_path)
+        case.clear_cache()
+        case.run()
+        np.testing.assert_array_equal(case.status_array(), [2, 2])
+        if function == 'broken':
+            assert 'RuntimeError: nope' in (case.storagepath / '1' / 'broken.stderr').read_text()
+            assert (case.storagepath / '1' / 'broken.1.stderr').exists()
+
+
+def test_function_modules(tmp_path):
+    # Cases with modules of the same name each get their own
+    path = list(sys.path)
+    for label in ('first', 'second'):
+        (tmp_path / label).mkdir()
+        (tmp_path / label / 'model.py').write_text(f"def model():\n    return {{'label': '{label}'}}\n")
+        (tmp_path / label / 'badger.yaml').write_text("""
+parameters:
+  alpha: [1]
+script:
+  - function: model:model
+types:
+  label: str
+""")
+        case = Case(tmp_path / label)
+        case.run()
+        assert case.result_array()['label'].tolist() == [label]
+    assert sys.path == path
+    assert 'model' not in sys.modules
+
+
+def test_persistent(tmp_path):
+    # Serves each request by doubling the value of alpha, and crashes when
+    # it's negative.  Every start is recorded.
+    (tmp_path / 'server.py').write_text("""
+import json, sys
+with open('starts', 'a') as f:
+    f.write('start\\n')
+while True:
+    header = sys.stdin.buffer.readline()
+    if not header:
+        break
+    context = json.loads(sys.stdin.buffer.read(int(header)))
+    if context['alpha'] < 0:
+        sys.exit(1)
+    output = f'double={2 * context["alpha"]}'.encode()
+    sys.stdout.buffer.write(b'%d %d\\n' % (context['alpha'] == 3, len(output)) + output)
+    sys.stdout.buffer.flush()
+""")
+    (tmp_path / 'badger.yaml').write_text(f"""
+parameters:
+  alpha: [1, 2, -1, 3, 4, 5]
+script:
+  - command: [{sys.executable}, server.py]
+    persistent: on
+    capture: double=(?P<double>\\d+)
+types:
+  double: int
+settings:
+  cache: off
+""")
+    case = Case(tmp_path)
+    case.run(jobs=2)
+
+    data = case.result_array()
+    np.testing.assert_array_equal(case.status_array(), [1, 1, 2, 2, 1, 1])
+    np.testing.assert_array_equal(data['double'][[0, 1, 4, 5]], [2, 4, 8, 10])
+
+    # One instance per job, and one more after the crash
+    assert (tmp_path / 'starts').read_text().count('start') <= 3
+    assert not case._commands[0]._servers._running
+
+
+def test_persistent_input(tmp_path):
+    # Echoes its input back
+    (tmp_path / 'echo.py').write_text("""
+import sys
+while header := sys.stdin.buffer.readline():
+    output = b'got=' + sys.stdin.buffer.read(int(header))
+    sys.stdout.buffer.write(b'0 %d\\n' % len(output) + output)
+    sys.stdout.buffer.flush()
+""")
+    text = f"""
+parameters:
+  alpha: [1, 2, 3]
+script:
+  - command: [{sys.executable}, echo.py]
+    persistent: on
+    input: ${{alpha * 10}}
+    capture: got=(?P<got>\\d+)
+types:
+  got: int
+"""
+    (tmp_path / 'badger.yaml').write_text(text)
+    case = Case(tmp_path)
+    case.run()
+    np.testing.assert_array_equal(case.result_array()['got'], [10, 20, 30])
+
+    # The command line of a persistent command can't vary between points
+    (tmp_path / 'badger.yaml').write_text(text.replace('echo.py', 'echo.py, "${alpha}"'))
+    with pytest.raises(ValueError):
+        Case(tmp_path)
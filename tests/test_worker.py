@@ -0,0 +1,140 @@
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+
+import numpy as np
+
+from badger import Case
+from badger.backend import BatchBackend
+
+
+DATADIR = Path(__file__).parent / 'data'
+ROOTDIR = Path(__file__).parent.parent
+
+
+def test_workers(tmp_path):
+    (tmp_path / 'badger.yaml').write_text((DATADIR / 'run' / 'echo.yaml').read_text())
+
+    env = dict(os.environ, PYTHONPATH=str(ROOTDIR))
+    workers = [
+        subprocess.Popen([sys.executable, '-m', 'badger', 'worker', '--jobs', '2', str(tmp_path)], env=env)
+        for _ in range(3)
+    ]
+    for worker in workers:
+        assert worker.wait(timeout=60) == 0
+
+    case = Case(tmp_path)
+    data = case.result_array()
+    np.testing.assert_array_equal(data['a'], [[1, 1, 1], [2, 2, 2], [3, 3, 3]])
+    np.testing.assert_array_equal(data['c'], [[1, 1, 1], [3, 3, 3], [5, 5, 5]])
+    assert case.status() == {
+        'total': 9, 'done': 9, 'failed': 0, 'timed-out': 0, 'retried': 0,
+        'claimed': 0, 'abandoned': 0, 'unclaimed': 0,
+    }
+
+
+def test_abandoned(tmp_path):
+    (tmp_path / 'badger.yaml').write_text((DATADIR / 'run' / 'echo.yaml').read_text())
+    case = Case(tmp_path)
+
+    # A lease from a dead worker, and one from a live worker
+    leases = case.leases()
+    assert leases.claim(3)
+    assert leases.claim(4)
+    os.utime(leases.path / '3', (0, 0))
+    assert case.status() == {
+        'total': 9, 'done': 0, 'failed': 0, 'timed-out': 0, 'retried': 0,
+        'claimed': 1, 'abandoned': 1, 'unclaimed': 7,
+    }
+
+    # Once the live worker finishes, the other one picks up the rest
+    leases.release(4)
+    case.work(heartbeat=0.1, timeout=1.0)
+    assert case.status()['done'] == 9
+
+
+def test_takeover(tmp_path):
+    (tmp_path / 'badger.yaml').write_text((DATADIR / 'run' / 'echo.yaml').read_text())
+    case = Case(tmp_path)
+
+    # Worker B takes over the expired lease of worker A
+    first, second = case.leases(timeout=1.0), case.leases(timeout=1.0)
+    assert first.claim(3)
+    os.utime(first.path / '3', (0, 0))
+    assert second.claim(3)
+
+    # A can neither renew nor release the lease it lost
+    os.utime(first.path / '3', (1, 1))
+    first.renew()
+    assert (first.path / '3').stat().st_mtime == 1
+    first.release(3)
+    assert (first.path / '3').exists()
+    assert 3 not in first._held
+
+    second.release(3)
+    assert not (first.path / '3').exists()
+
+
+def test_batch(tmp_path, monkeypatch):
+    # Paths with spaces must survive submission
+    queue = tmp_path / 'the queue'
+    tmp_path = tmp_path / 'the case'
+    tmp_path.mkdir()
+    (tmp_path / 'sweep.yaml').write_text((DATADIR / 'run' / 'echo.yaml').read_text())
+
+    # Both the submit command and the jobs run 'python -m badger'
+    monkeypatch.setenv('PYTHONPATH', str(ROOTDIR))
+    scheduler = subprocess.Popen(
+        [sys.executable, '-m', 'badger', 'scheduler', 'serve', '--jobs', '3', '--interval', '0.1', str(queue)],
+    )
+    try:
+        submit = f'{sys.executable} -m badger scheduler submit {shlex.quote(str(queue))} ${{listfile}}'
+        # The jobs use the same case file and storage as the submitting case
+        case = Case(tmp_path / 'sweep.yaml', tmp_path / 'store')
+        case.run(backend=BatchBackend(submit, chunk_size=4, interval=0.1))
+    finally:
+        scheduler.terminate()
+        scheduler.wait()
+
+    data = case.result_array()
+    np.testing.assert_array_equal(data['a'], [[1, 1, 1], [2, 2, 2], [3, 3, 3]])
+    np.testing.assert_array_equal(data['c'], [[1, 1, 1], [3, 3, 3], [5, 5, 5]])
+    assert case.status()['done'] == 9
+    assert len(list((case.storagepath / 'batch').glob('chunk-*.txt'))) == 3
+
+
+def test_batch_poll(tmp_path, monkeypatch):
+    (tmp_path / 'badger.yaml').write_text((DATADIR / 'run' / 'echo.yaml').read_text())
+    case = Case(tmp_path)
+    jobdir = tmp_path / 'jobs'
+    jobdir.mkdir()
+
+    # Point 0 committed its result after the status was read, point 1 exited
+    # without one, and point 2 is still writing its exit status
+    case.run_point(0)
+    pending = np.zeros((3, 3), dtype=np.uint8)
+    monkeypatch.setattr(case, 'status_array', lambda: pending)
+    (jobdir / '0.exit').write_text('0\n')
+    (jobdir / '1.exit').write_text('1\n')
+    (jobdir / '2.exit').write_text('')
+
+    poll = BatchBackend('true', interval=0.01)._poll(case, [0, 1, 2], jobdir)
+    assert [next(poll), next(poll)] == [0, 1]
+    status = case._store.status_array().ravel()
+    assert list(status[:3]) == [1, 2, 0]
+
+
+def test_run_point(tmp_path):
+    (tmp_path / 'badger.yaml').write_text((DATADIR / 'run' / 'echo.yaml').read_text())
+    Case(tmp_path)
+
+    # With the guessed types cached, a single point is evaluated on its own
+    case = Case(tmp_path)
+    assert case.run_point(5)
+    assert case._evaluated is None
+    data = case.result_array()
+    assert data['charlie'][1, 2] == 3
+    assert data['c'][1, 2] == 3.0
+    assert data.mask['charlie'].sum() == 8